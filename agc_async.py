@@ -0,0 +1,203 @@
+# AGC asyncio client for python
+# The AGC protocol for asyncio programs, with no threads and nothing from the window:
+#
+#   async with AGCClient("/dev/ttyS0", load_addresses()) as client:
+#       status = await client.status(6)
+#       await client.set_relay(6, closed=False)
+#
+# Positions count from 0 as everywhere else. The serial port is put in non-blocking mode and watched by the event
+# loop, so waiting for a reply costs nothing and any number of coroutines can await commands at once. Their
+# commands are queued by priority as on a BusWorker (see agc_scheduler.py) and run one at a time by a single task.
+# Reply timeouts, timings and circuit breakers are kept as on a BusWorker too.
+
+import asyncio
+import os
+import time
+
+from agc_bus import Reply, Timing
+from agc_capture import RX, TX
+from agc_health import HealthTracker
+from agc_metrics import BusMetrics
+from agc_protocol import ACK_LENGTH, BITS_PER_BYTE, COMMANDS_BY_NAME, COMMANDS_BY_OPCODE, STATUS_COMMAND, \
+    FrameParser, ReplyTiming, build_packet_table, decode_status, reply_ok
+from agc_scheduler import STATUS, TransactionQueue, interactive_priority
+from agc_timeouts import MAXIMUM, TimeoutProfile
+from agc_transport import TRANSPORT, open_port
+
+
+class AGCClient:
+    def __init__(self, port, addresses, baudrate=9600, timeout=MAXIMUM, profile=None, health=None, transport=TRANSPORT,
+                 capture=None):
+        # addresses is the AGC address of each position. Without a profile, timeout is the longest wait for a reply
+        # and nothing is kept after the client closes. capture is an agc_capture.Capture to record the traffic to.
+        self.port = port
+        self.addresses = tuple(addresses)
+        self.packets = build_packet_table(self.addresses)
+        self.baudrate = baudrate
+        self.transport = transport
+        self.capture = capture
+        self.channel = None
+        self.metrics = BusMetrics()
+        self.profile = TimeoutProfile(maximum=timeout) if profile is None else profile
+        self.health = HealthTracker() if health is None else health
+        self.requests = TransactionQueue()
+        self.ser = None
+        self.wakeup = None
+        self.runner = None
+
+    async def open(self):
+        self.ser = open_port(self.port, self.baudrate, 0, self.transport)
+        self.ser.nonblocking()
+        # The port is read and written here directly, so the traffic is recorded here too
+        if self.capture is not None:
+            self.channel = self.capture.channel(self.port)
+        self.wakeup = asyncio.Event()
+        self.runner = asyncio.get_running_loop().create_task(self.run())
+        return self
+
+    async def close(self):
+        # Everything already queued is still run.
+        self.requests.close()
+        self.wakeup.set()
+        await self.runner
+        self.ser.close()
+        self.profile.save()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def transact(self, position, opcode, priority=None):
+        # Sends opcode to position and returns the Reply. Without a priority it is an operator's command.
+        future = asyncio.get_running_loop().create_future()
+        self.requests.put((self.packets[position][opcode], future),
+                          interactive_priority(opcode) if priority is None else priority)
+        self.wakeup.set()
+        return await future
+
+    async def status(self, position, priority=STATUS):
+        # The decoded Status, None when no good reply came back.
+        reply = await self.transact(position, STATUS_COMMAND, priority)
+        return decode_status(reply.data) if reply_ok(reply.packet, reply.data) else None
+
+    async def command(self, position, name, priority=None):
+        # Whether the named command was acknowledged.
+        reply = await self.transact(position, COMMANDS_BY_NAME[name].opcode, priority)
+        return reply_ok(reply.packet, reply.data)
+
+    async def ping(self, position):
+        return await self.command(position, "ping")
+
+    async def set_relay(self, position, closed):
+        return await self.command(position, "relay_reset" if closed else "relay_trip")
+
+    async def set_agc_loop(self, position, closed):
+        return await self.command(position, "agc_close" if closed else "agc_open")
+
+    async def set_caps(self, position, cap1=None, cap2=None):
+        # Fits (True) or removes (False) each capacitor that is given, True when every command was acknowledged.
+        ok = True
+        for name, fitted in (("cap1", cap1), ("cap2", cap2)):
+            if fitted is not None:
+                ok = await self.command(position, f"{name}_close" if fitted else f"{name}_open") and ok
+        return ok
+
+    async def reset(self, position):
+        return await self.command(position, "reset")
+
+    async def auto_reset(self, position, enabled):
+        return await self.command(position, "auto_reset_enable" if enabled else "auto_reset_disable")
+
+    async def run(self):
+        while True:
+            taken = self.requests.poll()
+            if taken is None:
+                if self.requests.closed:
+                    break
+                # Nothing else runs between the poll and here, so no request can be missed
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            (packet, future), priority = taken
+            reply = await self.exchange(packet)
+            if not future.cancelled():
+                future.set_result(reply)
+
+    async def exchange(self, packet):
+        # Anything left on the line belongs to an earlier transaction and would confuse this one.
+        self.ser.reset_input_buffer()
+        write_start = time.monotonic()
+        await self.write(packet)
+        # The write returns once the packet is queued in the port, its time on the line is worked out instead of
+        # waiting for it to drain
+        write_complete = max(time.monotonic() - write_start, len(packet) * BITS_PER_BYTE / self.baudrate)
+        timeout = self.profile.timeout(packet[3], packet[1], self.health.take_probe(packet[1]))
+        data, reply_timing = await self.read_reply(packet, timeout, write_start + write_complete)
+        self.profile.record(packet[3], packet[1], reply_timing.first_byte)
+        timing = Timing(write_start, write_complete,
+                        None if reply_timing.first_byte is None else write_complete + reply_timing.first_byte,
+                        None if reply_timing.complete is None else write_complete + reply_timing.complete)
+        self.metrics.record(packet[3], packet[1], timing)
+        self.health.record(packet[1], reply_ok(packet, data))
+        return Reply(packet, data, timing)
+
+    async def write(self, packet):
+        fd = self.ser.fileno()
+        loop = asyncio.get_running_loop()
+        if self.channel is not None:
+            self.channel.record(TX, packet)
+        while packet:
+            try:
+                packet = packet[os.write(fd, packet):]
+            except BlockingIOError:
+                # The port's buffer is full, wait for room
+                writable = loop.create_future()
+                loop.add_writer(fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(fd)
+
+    async def read_reply(self, packet_sent, timeout, start):
+        # As agc_protocol.read_reply, but woken by the event loop as bytes arrive. Times are from start.
+        command = COMMANDS_BY_OPCODE[packet_sent[3]]
+        parser = FrameParser(packet_sent[1], ack=(command.reply_length == ACK_LENGTH))
+        fd = self.ser.fileno()
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        received = bytearray()
+        first_byte = []
+
+        def readable():
+            try:
+                chunk = os.read(fd, 256)
+            except BlockingIOError:
+                return
+            if chunk and self.channel is not None:
+                self.channel.record(RX, chunk)
+            if not chunk or done.done():
+                return
+            if not first_byte:
+                first_byte.append(max(0.0, time.monotonic() - start))
+                # The rest of the frame is given twice its time on the line on top of the timeout
+                timer[0].cancel()
+                timer[0] = loop.call_at(start + first_byte[0] + timeout
+                                        + 2 * command.reply_length * BITS_PER_BYTE / self.baudrate, expired)
+            received.extend(chunk)
+            frame = parser.feed(chunk)
+            if frame is not None:
+                done.set_result((frame, ReplyTiming(first_byte[0], max(0.0, time.monotonic() - start))))
+
+        def expired():
+            if not done.done():
+                done.set_result((bytes(received), ReplyTiming(first_byte[0] if first_byte else None, None)))
+
+        timer = [loop.call_at(start + timeout, expired)]
+        loop.add_reader(fd, readable)
+        try:
+            return await done
+        finally:
+            loop.remove_reader(fd)
+            timer[0].cancel()
@@ -0,0 +1,94 @@
+# AGC batch commands window
+# Sends one command to any set of positions at once (see Fleet.batch in agc_fleet.py): every reply is checked,
+# positions that did not answer properly are sent the command again, and the outcome of each position is shown.
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtWidgets import QAbstractItemView, QComboBox, QHBoxLayout, QLabel, QListWidget, QPushButton, QSpinBox, \
+    QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget
+
+from agc_fleet import BATCH_RETRIES
+from agc_protocol import COMMANDS
+
+COLUMNS = ("Position", "Address", "Result", "Attempts", "Reply time")
+
+
+# Results arrive on a bus thread, the signal hands them to the GUI thread.
+class BatchSignals(QObject):
+    done = pyqtSignal(object, object)
+
+
+class BatchWindow(QWidget):
+    def __init__(self, fleet):
+        super(BatchWindow, self).__init__()
+        self.fleet = fleet
+        self.setWindowTitle("AGC batch commands")
+        self.resize(640, 480)
+        self.signals = BatchSignals()
+        self.signals.done.connect(self.show_results)
+
+        self.positions = QListWidget()
+        self.positions.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.positions.addItems([f"{position + 1}  ({address:02x})"
+                                 for position, address in enumerate(fleet.addresses)])
+        self.select_all = QPushButton("All")
+        self.select_all.clicked.connect(self.positions.selectAll)
+        self.select_none = QPushButton("None")
+        self.select_none.clicked.connect(self.positions.clearSelection)
+        self.command = QComboBox()
+        # Status replies are read in the main window, everything else can be sent to many positions at once
+        self.commands = [command for command in COMMANDS if command.decode is None]
+        self.command.addItems([command.name for command in self.commands])
+        self.retries = QSpinBox()
+        self.retries.setRange(0, 10)
+        self.retries.setValue(BATCH_RETRIES)
+        self.send_button = QPushButton("Send")
+        self.send_button.clicked.connect(self.send)
+        self.summary = QLabel()
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+
+        selection = QHBoxLayout()
+        selection.addWidget(self.select_all)
+        selection.addWidget(self.select_none)
+        left = QVBoxLayout()
+        left.addWidget(self.positions)
+        left.addLayout(selection)
+        controls = QHBoxLayout()
+        controls.addWidget(self.command)
+        controls.addWidget(QLabel("Retries"))
+        controls.addWidget(self.retries)
+        controls.addStretch()
+        controls.addWidget(self.send_button)
+        right = QVBoxLayout()
+        right.addLayout(controls)
+        right.addWidget(self.table)
+        right.addWidget(self.summary)
+        layout = QHBoxLayout(self)
+        layout.addLayout(left, 1)
+        layout.addLayout(right, 3)
+
+    def send(self):
+        positions = sorted(index.row() for index in self.positions.selectedIndexes())
+        if not positions:
+            self.summary.setText("Select the positions to send to")
+            return
+        command = self.commands[self.command.currentIndex()]
+        self.send_button.setEnabled(False)
+        self.summary.setText(f"Sending {command.name} to {len(positions)} positions")
+        self.fleet.batch(command.opcode, positions, lambda results: self.signals.done.emit(command, results),
+                         self.retries.value())
+
+    def show_results(self, command, results):
+        self.send_button.setEnabled(True)
+        self.table.setRowCount(len(results))
+        for row, result in enumerate(results):
+            timing = result.reply.timing
+            cells = (str(result.position + 1), f"{self.fleet.addresses[result.position]:02x}",
+                     "good" if result.ok else "NO RESPONSE", str(result.attempts),
+                     "-" if timing.complete is None else f"{timing.complete * 1000:.1f} ms")
+            for column, text in enumerate(cells):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        failed = [str(result.position + 1) for result in results if not result.ok]
+        self.summary.setText(f"{command.name}: {len(results) - len(failed)} of {len(results)} good"
+                             + (f", no response from {', '.join(failed)}" if failed else ""))
@@ -0,0 +1,354 @@
+# AGC bus broker for python
+# One process owns the RS485 serial port and every other program reaches the bus through it, over a Unix socket
+# or TCP on this machine, so the commander window and the logging script can run at the same time without
+# fighting over the device or interleaving frames. Requests are run by priority class (see agc_scheduler.py),
+# taken from the clients in turn within a class, and each client's requests of one class run in the order it
+# sent them. When clients are waiting on the same packet at the same time, one transaction on the bus answers
+# them all.
+#
+#   python agc_broker.py --port /dev/ttyS0 --listen unix:///tmp/agc_bus.sock --listen tcp://localhost:4855
+#   python -m agc_commander poll --port unix:///tmp/agc_bus.sock
+#
+# Anywhere a serial port is given, unix://path and tcp://host:port go through a broker instead.
+#
+# On the socket a request is REQUEST (a number the client picks, whether a reply is expected, the priority class
+# and the packet length) then the packet, an empty packet only asking to be told once everything of its class
+# sent before it is done. Every request is answered with RESPONSE (the request's number, the Timing of the
+# transaction, NaN for None, and the reply length) then the reply. Answers can come in a different order to
+# the requests when their classes differ. A request with a class the scheduler does not have is answered at once
+# with no reply.
+
+import argparse
+import math
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+from agc_bus import BusWorker, Reply, Timing
+from agc_capture import Capture
+from agc_health import HealthTracker
+from agc_metrics import BusMetrics
+from agc_protocol import COMMANDS_BY_NAME, reply_ok
+from agc_scheduler import PRIORITY_NAMES, STATUS, TransactionQueue
+from agc_timeouts import MAXIMUM, MINIMUM, STATE_DIRECTORY, TimeoutProfile, profile_file
+from agc_transport import TRANSPORT, TRANSPORTS
+
+REQUEST = struct.Struct("!IBBB")
+RESPONSE = struct.Struct("!I4dB")
+DEFAULT_TCP_PORT = 4855
+# Only commands that read are shared between clients. Two clients that each send a command that changes something,
+# e.g. a reset, each get a transaction of their own, so neither is told it ran when it was the other's.
+SHAREABLE = frozenset(COMMANDS_BY_NAME[name].opcode for name in ("status", "ping"))
+
+
+def is_broker(port):
+    return port.startswith(("unix://", "tcp://"))
+
+
+def connect(address):
+    if address.startswith("unix://"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address[len("unix://"):])
+        return sock
+    host, _, port = address[len("tcp://"):].rpartition(":")
+    sock = socket.create_connection((host, int(port)))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def encode_timing(timing):
+    return [math.nan if value is None else value for value in timing]
+
+
+def decode_timing(values):
+    return Timing(*[None if math.isnan(value) else value for value in values])
+
+
+def open_bus(port, timeout=MAXIMUM, minimum=MINIMUM, profiles=STATE_DIRECTORY, health=None, transport=TRANSPORT,
+             capture=None):
+    # A BusWorker for a serial port, or a BrokerClient for a broker. The broker keeps the reply timeouts for
+    # its port, so nothing is saved for a client, and picks its own transport and capture.
+    if is_broker(port):
+        return BrokerClient(port, TimeoutProfile(None, minimum, timeout), health)
+    return BusWorker(port, timeout=timeout, profile=TimeoutProfile(profiles and profile_file(port, profiles),
+                                                                   minimum, timeout), health=health,
+                     transport=transport, capture=capture)
+
+
+class BrokerClient(threading.Thread):
+    # Stands in for a BusWorker: the same submit(), call() and stop(), and the same metrics, profile and health
+    # kept from the replies the broker sends back.
+    def __init__(self, address, profile=None, health=None):
+        super(BrokerClient, self).__init__(name=f"bus {address}", daemon=True)
+        # Connected here so a broker that is not running fails at start up, as a missing serial port does.
+        self.sock = connect(address)
+        self.replies = self.sock.makefile("rb")
+        self.lock = threading.Lock()
+        # Request number: (packet, callback, expect_reply)
+        self.pending = {}
+        self.next_number = 0
+        self.stopping = False
+        self.metrics = BusMetrics()
+        self.profile = TimeoutProfile() if profile is None else profile
+        self.health = HealthTracker() if health is None else health
+
+    def submit(self, packet, callback=None, expect_reply=True, priority=STATUS):
+        packet = bytes(packet)
+        with self.lock:
+            if self.stopping:
+                raise RuntimeError("bus stopped")
+            number = self.next_number
+            self.next_number = (number + 1) % 2 ** 32
+            # Kept before sending, so the reply always finds its request
+            self.pending[number] = (packet, callback, expect_reply)
+            try:
+                self.sock.sendall(REQUEST.pack(number, expect_reply, priority, len(packet)) + packet)
+            except OSError:
+                pass    # run() finds the connection closed and answers everything still pending
+
+    def call(self, packet, expect_reply=True, priority=STATUS):
+        done = threading.Event()
+        replies = []
+        self.submit(packet, lambda reply: (replies.append(reply), done.set()), expect_reply, priority)
+        done.wait()
+        return replies[0]
+
+    def queue_summary(self):
+        # Requests wait at the broker, which keeps the queue metrics for its port.
+        return None
+
+    def stop(self):
+        # As for a BusWorker, everything already submitted is still run.
+        with self.lock:
+            self.stopping = True
+            if not self.pending:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass    # Already closed
+
+    def run(self):
+        while True:
+            header = self.replies.read(RESPONSE.size)
+            if len(header) < RESPONSE.size:
+                break
+            values = RESPONSE.unpack(header)
+            data = self.replies.read(values[-1])
+            timing = decode_timing(values[1:5])
+            with self.lock:
+                packet, callback, expect_reply = self.pending.pop(values[0])
+            if packet and expect_reply:
+                self.metrics.record(packet[3], packet[1], timing)
+                self.profile.record(packet[3], packet[1], None if timing.first_byte is None
+                                    else timing.first_byte - timing.write_complete)
+                self.health.record(packet[1], reply_ok(packet, data))
+            if callback is not None:
+                callback(Reply(packet, data, timing))
+            with self.lock:
+                if self.stopping and not self.pending:
+                    break
+        # The broker went away, nothing still waiting will be answered
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for packet, callback, expect_reply in pending.values():
+            if callback is not None:
+                callback(Reply(packet, b"", Timing(time.monotonic(), None, None, None)))
+        self.sock.close()
+
+
+class BrokerRequest:
+    def __init__(self, client, number, packet, expect_reply, priority):
+        self.client = client
+        self.number = number
+        self.packet = packet
+        self.expect_reply = expect_reply
+        self.priority = priority
+        self.key = (packet, expect_reply)
+        self.shareable = len(packet) > 3 and packet[3] in SHAREABLE
+        self.arrived = time.monotonic()
+
+
+class BrokerClientHandler(socketserver.StreamRequestHandler):
+    # One per connected client, reading its requests into the broker's queue.
+    def handle(self):
+        broker = self.server.broker
+        self.send_lock = threading.Lock()
+        broker.add_client(self)
+        try:
+            while True:
+                header = self.rfile.read(REQUEST.size)
+                if len(header) < REQUEST.size:
+                    break
+                number, expect_reply, priority, length = REQUEST.unpack(header)
+                packet = self.rfile.read(length)
+                if len(packet) < length:
+                    break
+                request = BrokerRequest(self, number, packet, bool(expect_reply), priority)
+                if priority >= len(PRIORITY_NAMES):
+                    # Not a class the scheduler has, answered at once as not replied to
+                    self.respond(request, Reply(packet, b"", Timing(time.monotonic(), None, None, None)))
+                    continue
+                broker.queue(request)
+        finally:
+            broker.remove_client(self)
+
+    def respond(self, request, reply):
+        try:
+            with self.send_lock:
+                self.wfile.write(RESPONSE.pack(request.number, *encode_timing(reply.timing), len(reply.data))
+                                 + reply.data)
+        except OSError:
+            pass    # The client has gone, its reader finds that too
+
+
+class BrokerTCPServer(socketserver.ThreadingTCPServer):
+    # A restarted broker can listen again straight away, rather than after the old connections time out
+    allow_reuse_address = True
+
+
+class Broker:
+    def __init__(self, bus):
+        self.bus = bus
+        self.lock = threading.Lock()
+        self.clients = []
+        self.requests = TransactionQueue()
+        self.servers = []
+        self.thread = None
+        self.transactions = 0
+        self.shared = 0
+
+    def listen(self, address):
+        if address.startswith("unix://"):
+            path = address[len("unix://"):]
+            if os.path.exists(path):
+                # Left behind by a broker that has gone, unless one still answers on it
+                try:
+                    connect(address).close()
+                except ConnectionRefusedError:
+                    os.remove(path)
+                else:
+                    raise OSError(f"another broker is listening on {path}")
+            # Only users who could open the serial port themselves should reach it. The socket is made with those
+            # permissions, rather than changed after, so there is never a moment anyone else can connect.
+            umask = os.umask(0o117)
+            try:
+                server = socketserver.ThreadingUnixStreamServer(path, BrokerClientHandler)
+            finally:
+                os.umask(umask)
+        else:
+            host, _, port = address[len("tcp://"):].rpartition(":")
+            server = BrokerTCPServer((host or "localhost", int(port or DEFAULT_TCP_PORT)), BrokerClientHandler)
+        server.daemon_threads = True
+        server.broker = self
+        self.servers.append(server)
+        threading.Thread(target=server.serve_forever, name=f"broker {address}", daemon=True).start()
+
+    def add_client(self, client):
+        with self.lock:
+            self.clients.append(client)
+        print(f"{time.strftime('%d-%m-%Y  %T')} client connected, {len(self.clients)} now", flush=True)
+
+    def remove_client(self, client):
+        with self.lock:
+            self.clients.remove(client)
+        # Nobody is left to answer
+        self.requests.discard(client)
+        print(f"{time.strftime('%d-%m-%Y  %T')} client disconnected, {len(self.clients)} now", flush=True)
+
+    def queue(self, request):
+        self.requests.put(request, request.priority, request.client)
+
+    def take_same(self, request, before):
+        # Takes every other client's next request of the same class that is the same packet and arrived before
+        # the given time. Only the next request of each client is taken, so no client sees a reply from before
+        # its own earlier commands ran.
+        return self.requests.take_matching(request.priority, request.client,
+                                           lambda other: other.key == request.key and other.arrived <= before)
+
+    def queue_summary(self):
+        return self.requests.summary()
+
+    def run(self):
+        while True:
+            taken = self.requests.get()
+            if taken is None:
+                break
+            request, priority = taken
+            if not request.packet:
+                request.client.respond(request, Reply(b"", b"", Timing(time.monotonic(), None, None, None)))
+                continue
+            requests = [request]
+            if request.shareable:
+                requests += self.take_same(request, time.monotonic())
+            reply = self.bus.call(request.packet, request.expect_reply, priority)
+            if request.shareable:
+                # Whoever asked for the same while it was on the bus has the answer too
+                requests += self.take_same(request, time.monotonic())
+            self.transactions += 1
+            self.shared += len(requests) - 1
+            for each in requests:
+                each.client.respond(each, reply)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="broker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+            if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+                os.remove(server.server_address)
+        # What is already queued is still run
+        self.requests.close()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shares one AGC serial port between several programs")
+    parser.add_argument("--port", default="/dev/ttyS0", help="serial port")
+    parser.add_argument("--listen", action="append",
+                        help=f"unix://path or tcp://host:port to accept clients on, can be given more than once "
+                             f"(default tcp://localhost:{DEFAULT_TCP_PORT})")
+    parser.add_argument("--profiles", default=STATE_DIRECTORY,
+                        help="directory the learned reply timeouts are kept in, one file per port")
+    parser.add_argument("--min-timeout", type=float, default=MINIMUM, help="shortest wait for a reply in seconds")
+    parser.add_argument("--max-timeout", type=float, default=MAXIMUM, help="longest wait for a reply in seconds")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT,
+                        help="how the serial port is driven, see agc_transport.py")
+    parser.add_argument("--capture", help="record every byte on the serial port to this file, see agc_capture.py")
+    args = parser.parse_args()
+
+    capture = Capture(args.capture) if args.capture else None
+    bus = open_bus(args.port, args.max_timeout, args.min_timeout, args.profiles, transport=args.transport,
+                   capture=capture)
+    bus.start()
+    broker = Broker(bus)
+    broker.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for address in args.listen or [f"tcp://localhost:{DEFAULT_TCP_PORT}"]:
+            broker.listen(address)
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        sys.exit(f"can't listen: {error}")
+    finally:
+        broker.stop()
+        bus.stop()
+        bus.join()
+        if capture is not None:
+            capture.close()
+        print(f"{broker.transactions} bus transactions, {broker.shared} requests answered from another's", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# AGC bus worker for python
+# One thread owns the serial port and runs commands from a queue one at a time, so nothing that talks
+# to the RS485 bus ever blocks the thread it was asked from. The queue puts an operator's commands ahead of
+# sweeps, see agc_scheduler.py.
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from agc_health import HealthTracker
+from agc_metrics import BusMetrics
+from agc_protocol import read_reply, reply_ok
+from agc_scheduler import STATUS, TransactionQueue
+from agc_timeouts import TimeoutProfile
+from agc_transport import TRANSPORT, open_port
+
+# packet is the command that was written, data the reply bytes as received, timing a Timing.
+Reply = namedtuple("Reply", ["packet", "data", "timing"])
+# write_start is time.monotonic() as the write began. The others are seconds after that: the packet has left
+# the port, the first reply byte arrived and the reply frame was complete. Each is None when never reached.
+Timing = namedtuple("Timing", ["write_start", "write_complete", "first_byte", "complete"])
+
+
+class BusWorker(threading.Thread):
+    def __init__(self, port, baudrate=9600, timeout=1, profile=None, health=None, transport=TRANSPORT, capture=None):
+        super(BusWorker, self).__init__(name=f"bus {port}", daemon=True)
+        # The port is opened here so a missing device fails at start up, but it is only used from run(). transport
+        # is one of those in agc_transport.py, capture an agc_capture.Capture to record the port's traffic to.
+        self.ser = open_port(port, baudrate, timeout, transport, capture)
+        self.requests = TransactionQueue()
+        self.metrics = BusMetrics()
+        # How long to wait for each reply, learned as the bus is used. Without a profile, timeout is the longest wait
+        # and nothing is kept after the worker stops.
+        self.profile = TimeoutProfile(maximum=timeout) if profile is None else profile
+        # Whether each address is answering, from every reply that was expected. Sweeps ask it which to leave out.
+        self.health = HealthTracker() if health is None else health
+
+    def submit(self, packet, callback=None, expect_reply=True, priority=STATUS):
+        # callback(reply) is called on the worker thread once the transaction is finished. priority is one of
+        # the classes in agc_scheduler.py.
+        self.requests.put((bytes(packet), callback, expect_reply), priority)
+
+    def call(self, packet, expect_reply=True, priority=STATUS):
+        # Runs the transaction and waits for its reply, for callers that are happy to block.
+        done = queue.Queue(maxsize=1)
+        self.submit(packet, done.put, expect_reply, priority)
+        return done.get()
+
+    def queue_summary(self):
+        # Depth and waiting time of each priority class, see TransactionQueue.summary.
+        return self.requests.summary()
+
+    def stop(self):
+        # Everything already submitted is still run.
+        self.requests.close()
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            (packet, callback, expect_reply), priority = request
+            if not packet:
+                # Nothing to send, the caller only wants to know everything of its priority queued before it is done
+                if callback is not None:
+                    callback(Reply(packet, b"", Timing(time.monotonic(), None, None, None)))
+                continue
+            # Anything left on the line belongs to an earlier transaction and would confuse this one.
+            self.ser.reset_input_buffer()
+            write_start = time.monotonic()
+            self.ser.write(packet)
+            self.ser.flush()
+            write_complete = time.monotonic() - write_start
+            if expect_reply:
+                timeout = self.profile.timeout(packet[3], packet[1], self.health.take_probe(packet[1]))
+                data, reply_timing = read_reply(self.ser, packet, timeout)
+                self.profile.record(packet[3], packet[1], reply_timing.first_byte)
+                timing = Timing(write_start, write_complete,
+                                None if reply_timing.first_byte is None else write_complete + reply_timing.first_byte,
+                                None if reply_timing.complete is None else write_complete + reply_timing.complete)
+                self.metrics.record(packet[3], packet[1], timing)
+                self.health.record(packet[1], reply_ok(packet, data))
+            else:
+                data, timing = b"", Timing(write_start, write_complete, None, None)
+            if callback is not None:
+                callback(Reply(packet, data, timing))
+        self.ser.close()
+        self.profile.save()
@@ -0,0 +1,146 @@
+# AGC serial capture for python
+# Records every byte written to and read from the serial ports, with time.monotonic_ns() when it went out or came in,
+# to an append only binary file for looking at later or replaying (see agc_replay.py). The bus threads only put
+# each record on a queue, a thread of its own writes them out, so capturing never holds up the bus.
+#
+#   python -m agc_commander daemon --capture agc.cap
+#   AGC_CAPTURE=agc.cap python agc_commander.py
+#
+# The file is MAGIC then records, each RECORD (time, channel, kind, length) then length bytes. Every port opened gets a
+# channel number, and an OPEN record whose data is the wall clock time in ns (8 bytes) then the port name, so the
+# monotonic times can be related to the time of day. Later runs append to the same file, channel numbers start again
+# at 0 after each run's OPEN records.
+
+import os
+import queue
+import struct
+import threading
+import time
+
+MAGIC = b"AGCCAP01"
+RECORD = struct.Struct("<qBBH")
+WALL_CLOCK = struct.Struct("<q")
+OPEN = 0
+TX = 1
+RX = 2
+KIND_NAMES = {OPEN: "open", TX: "tx", RX: "rx"}
+
+# AGC_CAPTURE in the environment captures the commander window's traffic to that file.
+CAPTURE_FILE = os.environ.get("AGC_CAPTURE")
+
+
+class Capture:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.records = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.channels = 0
+        self.thread = threading.Thread(target=self.run, name="capture", daemon=True)
+        self.thread.start()
+
+    def channel(self, port):
+        # A CaptureChannel for a newly opened port.
+        with self.lock:
+            number = self.channels
+            self.channels += 1
+        self.record(number, OPEN, WALL_CLOCK.pack(time.time_ns()) + port.encode())
+        return CaptureChannel(self, number)
+
+    def record(self, channel, kind, data):
+        self.records.put((time.monotonic_ns(), channel, kind, bytes(data)))
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            # Everything that queued up while the last batch was written goes out in one write
+            try:
+                while True:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in batch
+            self.file.write(b"".join(RECORD.pack(timestamp, channel, kind, len(data)) + data
+                                     for timestamp, channel, kind, data in filter(None, batch)))
+            self.file.flush()
+            if stop:
+                break
+
+    def close(self):
+        # Everything recorded so far is written first.
+        self.records.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+class CaptureChannel:
+    def __init__(self, capture, number):
+        self.capture = capture
+        self.number = number
+
+    def record(self, kind, data):
+        self.capture.record(self.number, kind, data)
+
+
+class CapturedPort:
+    # Wraps a port from agc_transport.py, recording what is written to and read from it. Bytes thrown away by
+    # reset_input_buffer are never read, so they are not captured.
+    def __init__(self, port, channel):
+        self.port = port
+        self.channel = channel
+
+    @property
+    def timeout(self):
+        return self.port.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.port.timeout = value
+
+    @property
+    def baudrate(self):
+        return self.port.baudrate
+
+    def write(self, data):
+        self.channel.record(TX, data)
+        return self.port.write(data)
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        if data:
+            self.channel.record(RX, data)
+        return data
+
+    def flush(self):
+        self.port.flush()
+
+    def reset_input_buffer(self):
+        self.port.reset_input_buffer()
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def nonblocking(self):
+        self.port.nonblocking()
+
+    def close(self):
+        self.port.close()
+
+
+def read_capture(path):
+    # Yields (time, channel, kind, data) for every record. A record cut short at the end, by a capture still being
+    # written or a crash, is left out.
+    with open(path, "rb") as capture_file:
+        if capture_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an AGC capture file")
+        while True:
+            header = capture_file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, channel, kind, length = RECORD.unpack(header)
+            data = capture_file.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, channel, kind, data
@@ -0,0 +1,97 @@
+# AGC change detection for python
+# Compares each status reply of a position with what was last logged for it, so a log only grows when something
+# happens: a port A, B or C bit flips, an analogue reading moves further than its deadband from the value last logged,
+# or the position stops or starts answering. Every keyframe_interval seconds, and the first time a position is seen,
+# all of its readings are logged as a keyframe, so any stretch of the log can be read without going back to the start.
+#
+#   AGC  7 key  5V 5.02  15V 15.06  500V 501.96  -15V -15.06  50V 50.2  temp 40  fwd 100  refl 20  A 05  B 14  C ff
+#   AGC  7 temp 40>47  15V 15.06>14.47  bad_SWR 0>1
+#   AGC  7 no response
+#
+# Deadbands are in the raw 0-255 counts of the reading, so a drift smaller than the deadband is never logged however
+# long it goes on, and one that adds up to more is logged once it does.
+
+import time
+from collections import namedtuple
+
+from agc_protocol import FIFTEEN, FIFTY, FIVE, FIVE_HUNDRED, FLAGS, FORWARD, MINUS_FIFTEEN, PORT_A, PORT_B, PORT_C, \
+    REFLECTED, TEMP, decode_status
+
+# Counts a reading has to move before it is logged, and seconds between keyframes.
+DEADBAND = 2
+KEYFRAME_INTERVAL = 3600
+
+# (name, offset in the frame, label) of the analogue readings and of the ports
+ANALOGUE = (("five", FIVE, "5V"), ("fifteen", FIFTEEN, "15V"), ("five_hundred", FIVE_HUNDRED, "500V"),
+            ("minus_fifteen", MINUS_FIFTEEN, "-15V"), ("fifty", FIFTY, "50V"), ("temp", TEMP, "temp"),
+            ("forward", FORWARD, "fwd"), ("reflected", REFLECTED, "refl"))
+PORTS = (("port_a", PORT_A, "A"), ("port_b", PORT_B, "B"), ("port_c", PORT_C, "C"))
+FLAG_NAMES = {(offset, bit): (name, inverted) for name, offset, bit, inverted in FLAGS}
+
+# What is logged for a position. keyframe is True for a full set of readings, changes is the text of each change.
+# A position that stopped answering has status None.
+Change = namedtuple("Change", ["position", "time", "keyframe", "status", "changes"])
+
+
+def position_name(position):
+    # How a position is named in the log, e.g. "AGC  7", counting from 1.
+    return f"AGC {position + 1:2d}"
+
+
+def describe_change(change):
+    # The log line for a Change, without the time.
+    if change.status is None:
+        return f"{position_name(change.position)} no response"
+    if change.keyframe:
+        status = change.status
+        readings = "  ".join(f"{label} {getattr(status, name)}" for name, offset, label in ANALOGUE)
+        ports = "  ".join(f"{label} {getattr(status, name):02x}" for name, offset, label in PORTS)
+        return f"{position_name(change.position)} key  {readings}  {ports}"
+    return f"{position_name(change.position)} {'  '.join(change.changes)}"
+
+
+class ChangeDetector:
+    def __init__(self, deadband=DEADBAND, keyframe_interval=KEYFRAME_INTERVAL, deadbands=None):
+        # deadbands maps a reading's name to a deadband of its own, the others have deadband.
+        self.deadbands = {name: (deadbands or {}).get(name, deadband) for name, offset, label in ANALOGUE}
+        self.keyframe_interval = keyframe_interval
+        # position: the frame last logged, with each reading as it was when last logged
+        self.logged = {}
+        self.keyframes = {}
+        self.answering = {}
+
+    def compare(self, position, frame, now=None):
+        # frame is a good status reply, or None when the position did not answer. Returns the Change to log, or
+        # None when nothing has.
+        now = time.time() if now is None else now
+        if frame is None:
+            # Logged once when it stops answering, rather than on every poll
+            if self.answering.get(position, True):
+                self.answering[position] = False
+                return Change(position, now, False, None, [])
+            return None
+        answered_again = not self.answering.get(position, True)
+        self.answering[position] = True
+        last = self.logged.get(position)
+        if last is None or answered_again or now - self.keyframes[position] >= self.keyframe_interval:
+            self.logged[position] = bytearray(frame)
+            self.keyframes[position] = now
+            return Change(position, now, True, decode_status(frame), [])
+        changes = []
+        before, status = decode_status(last), decode_status(frame)
+        for name, offset, label in ANALOGUE:
+            if abs(frame[offset] - last[offset]) > self.deadbands[name]:
+                changes.append(f"{label} {getattr(before, name)}>{getattr(status, name)}")
+                last[offset] = frame[offset]
+        for name, offset, label in PORTS:
+            flipped = frame[offset] ^ last[offset]
+            for bit in range(8):
+                if flipped >> bit & 1:
+                    # A named flag as it is shown in the window, any other bit as it is, e.g. C7 1>0
+                    flag, inverted = FLAG_NAMES.get((offset, bit), (f"{label}{bit}", False))
+                    was, now_set = (last[offset] >> bit & 1) ^ inverted, (frame[offset] >> bit & 1) ^ inverted
+                    changes.append(f"{flag} {was}>{now_set}")
+            last[offset] = frame[offset]
+        if not changes:
+            return None
+        return Change(position, now, False, status, changes)
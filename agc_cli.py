@@ -0,0 +1,188 @@
+# AGC commander without a window
+# Runs single commands, or a polling daemon, from the command line for cron jobs, systemd units and site
+# machines with no display. Nothing here imports PyQt5, and numpy is only loaded when telemetry is kept.
+#
+#   python -m agc_commander status --pos 7
+#   python -m agc_commander ping --pos 7
+#   python -m agc_commander reset --pos 7
+#   python -m agc_commander send relay_trip --pos 7
+#   python -m agc_commander send agc_open --pos 1 2 3 --retries 3
+#   python -m agc_commander poll
+#   python -m agc_commander daemon --interval 60 --telemetry telemetry --timings bus_timings.json
+#   python -m agc_commander daemon --interval 60 --history telemetry.sqlite3
+#   python -m agc_commander poll --fleet fleet.json
+#   python -m agc_commander daemon --capture agc.cap
+
+import argparse
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+from agc_capture import Capture
+from agc_fleet import BATCH_RETRIES, FLEET_FILE, Fleet, load_groups
+from agc_health import BASE_BACKOFF, describe
+from agc_history import TelemetryHistory
+from agc_positions import POSITIONS_CSV, load_addresses
+from agc_protocol import COMMANDS_BY_NAME, FLAGS, reply_ok
+from agc_scheduler import BACKGROUND
+from agc_timeouts import MAXIMUM, MINIMUM, STATE_DIRECTORY
+from agc_transport import TRANSPORT, TRANSPORTS
+
+SERIAL_PORT = '/dev/ttyS0'     # For use in field
+COMMANDS = ("status", "ping", "reset", "send", "poll", "daemon")
+
+
+def format_status(position, status):
+    flags = " ".join(name for name, offset, bit, inverted in FLAGS if getattr(status, name))
+    return (f"AGC {position + 1:2d} addr {status.address:02x}  5V {status.five}  15V {status.fifteen}  "
+            f"500V {status.five_hundred}  -15V {status.minus_fifteen}  50V {status.fifty}  temp {status.temp}  "
+            f"fwd {status.forward}  refl {status.reflected}  A {status.port_a:08b}  B {status.port_b:08b}  "
+            f"C {status.port_c:08b}  {flags}")
+
+
+def report(command, result):
+    # Prints the outcome of one command to one position.
+    position, reply = result.position, result.reply
+    attempts = f" ({result.attempts} attempts)" if result.attempts > 1 else ""
+    if not result.ok:
+        print(f"AGC {position + 1:2d} {command.name}: NO RESPONSE ({reply.data.hex()}){attempts}")
+    elif command.decode is not None:
+        print(format_status(position, command.decode(reply.data)) + attempts)
+    else:
+        print(f"AGC {position + 1:2d} {command.name}: response good{attempts}")
+
+
+def run_command(fleet, name, positions, retries=0, priority=None):
+    # Sends one command to each of positions, every bus working at once, and prints the outcomes in position
+    # order. Returns the replies.
+    command = COMMANDS_BY_NAME[name]
+    results = fleet.call_batch(command.opcode, positions, retries, priority)
+    for result in results:
+        report(command, result)
+    return [result.reply for result in results]
+
+
+def sweep(fleet, telemetry=None, history=None):
+    # Status of every position once, leaving out those whose breaker is open. Returns how many answered. Through a
+    # broker, anything an operator asks for meanwhile goes first. The sweep goes into the history in one transaction.
+    print(datetime.now().strftime("%d-%m-%Y"   "  %T"))
+    positions = [position for position in range(len(fleet.addresses)) if fleet.allow(position)]
+    replies = dict(zip(positions, run_command(fleet, "status", positions, priority=BACKGROUND)))
+    answered = 0
+    for position in range(len(fleet.addresses)):
+        reply = replies.get(position)
+        good = reply is not None and reply_ok(reply.packet, reply.data)
+        answered += good
+        if telemetry is not None:
+            telemetry.append(position, reply.data if good else None)
+        if history is not None:
+            history.append(position, reply.data if good else None)
+    if history is not None:
+        history.commit()
+    sys.stdout.flush()
+    return answered
+
+
+def daemon(fleet, interval, telemetry=None, timings=None, history=None):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    while not stop.is_set():
+        started = time.monotonic()
+        sweep(fleet, telemetry, history)
+        if timings:
+            fleet.dump_metrics(timings)
+        fleet.save_profiles()
+        stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m agc_commander", description="AGC commander without a window")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("name", nargs="?", choices=sorted(COMMANDS_BY_NAME), help="command for send")
+    parser.add_argument("--pos", type=int, nargs="+", help="antenna positions, 1 upwards")
+    parser.add_argument("--all", action="store_true", help="every position")
+    parser.add_argument("--retries", type=int, default=BATCH_RETRIES,
+                        help="times a command is sent again to a position that did not answer properly")
+    parser.add_argument("--port", default=SERIAL_PORT)
+    parser.add_argument("--positions", default=POSITIONS_CSV, help="antenna_positions.csv")
+    parser.add_argument("--fleet", default=FLEET_FILE,
+                        help="positions on several serial ports, see agc_fleet.py (replaces --port and --positions)")
+    parser.add_argument("--interval", type=float, default=600, help="seconds between daemon sweeps")
+    parser.add_argument("--telemetry", help="keep every status reply in ring buffer files in this directory")
+    parser.add_argument("--retention", type=float, default=7,
+                        help="days of daemon sweeps the telemetry files made keep (existing files keep their size)")
+    parser.add_argument("--history", help="keep every status reply of poll and daemon in this SQLite database, "
+                                          "see agc_history.py")
+    parser.add_argument("--timings", help="save the bus timing histograms to this JSON file when done "
+                                          "(after every sweep for the daemon)")
+    parser.add_argument("--profiles", default=STATE_DIRECTORY,
+                        help="directory the learned reply timeouts are kept in, one file per port")
+    parser.add_argument("--min-timeout", type=float, default=MINIMUM, help="shortest wait for a reply in seconds")
+    parser.add_argument("--max-timeout", type=float, default=MAXIMUM, help="longest wait for a reply in seconds")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT,
+                        help="how the serial ports are driven, see agc_transport.py")
+    parser.add_argument("--capture", help="record every byte on the serial ports to this file, see agc_capture.py")
+    args = parser.parse_args(argv)
+
+    if args.command in ("status", "ping", "reset") and args.pos is None and not args.all:
+        parser.error(f"{args.command} needs --pos or --all")
+    if args.command == "send" and (args.name is None or (args.pos is None and not args.all)):
+        parser.error("send needs a command name and --pos or --all")
+    # The positions are read before anything is opened, so a bad --pos is reported without touching the ports
+    try:
+        if args.fleet:
+            groups = load_groups(args.fleet)
+        else:
+            addresses = load_addresses(args.positions)
+    except OSError as error:
+        parser.error(str(error))
+    count = sum(len(group.addresses) for group in groups) if args.fleet else len(addresses)
+    if args.pos is not None and not all(1 <= position <= count for position in args.pos):
+        parser.error(f"--pos must be between 1 and {count}")
+
+    capture = Capture(args.capture) if args.capture else None
+    options = dict(timeout=args.max_timeout, minimum=args.min_timeout, profiles=args.profiles,
+                   base_backoff=max(BASE_BACKOFF, args.interval), transport=args.transport, capture=capture)
+    if args.fleet:
+        fleet = Fleet(groups, **options)
+    else:
+        fleet = Fleet.single(args.port, addresses, **options)
+
+    telemetry = None
+    if args.telemetry:
+        from agc_telemetry import TelemetryStore, capacity_for
+        telemetry = TelemetryStore(args.telemetry, capacity_for(args.retention * 86400, args.interval))
+    history = TelemetryHistory(args.history) if args.history else None
+
+    if args.command == "daemon":
+        # Positions that stop or start answering are reported once, rather than on every sweep
+        fleet.add_health_listener(lambda position, node: print(describe(node, position)))
+    fleet.start()
+    try:
+        if args.command == "poll":
+            return 0 if sweep(fleet, telemetry, history) == count else 1
+        if args.command == "daemon":
+            daemon(fleet, args.interval, telemetry, args.timings, history)
+            return 0
+        name = {"send": args.name}.get(args.command, args.command)
+        positions = range(count) if args.pos is None else [position - 1 for position in args.pos]
+        replies = run_command(fleet, name, positions, args.retries)
+        return 0 if all(reply_ok(reply.packet, reply.data) for reply in replies) else 1
+    finally:
+        fleet.stop()
+        fleet.join()
+        if args.timings:
+            fleet.dump_metrics(args.timings)
+        if telemetry is not None:
+            telemetry.close()
+        if history is not None:
+            history.close()
+        if capture is not None:
+            capture.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
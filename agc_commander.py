@@ -3,23 +3,34 @@
 # by Cassie Lakin
 # September  11th 2022
 # This version is for use on site in Finland. It has no logging which is done by another script on site
+# Given a command (python -m agc_commander status --pos 7) it runs without a window, see agc_cli.py
 
-from PyQt5.QtWidgets import QApplication, QPushButton, QMainWindow, QLabel, \
-    QComboBox, QCheckBox, QLCDNumber
-from PyQt5 import uic
-from PyQt5.QtCore import QTimer
-from datetime import datetime
 import sys
-import serial
-import pandas as pd
-import time
+import agc_cli
 
-ser = serial.Serial('/dev/ttyS0')     # For use in field
-ser.baudrate = 9600
-ser.bytesize = 8
-ser.parity = 'N'
-ser.stopbits = 1
-ser.timeout = 1
+# Headless commands are handed over before PyQt5 is imported
+if __name__ == "__main__" and sys.argv[1:2] and sys.argv[1] in agc_cli.COMMANDS:
+    sys.exit(agc_cli.main())
+
+from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel
+from PyQt5.QtCore import QTimer, QObject, Qt, pyqtSignal
+from PyQt5.QtGui import QColor
+from datetime import datetime
+import time
+from agc_batch import BatchWindow
+from agc_capture import CAPTURE_FILE, Capture
+from agc_diagnostics import DiagnosticsWindow
+from agc_fleet import FLEET_FILE, Fleet
+from agc_health import HALF_OPEN, HEALTHY, OPEN, SUSPECT, describe
+from agc_overview import OverviewWindow
+from agc_positions import load_addresses
+from agc_protocol import COMMANDS_BY_NAME, reply_ok
+from agc_scheduler import STATUS, interactive_priority
+from agc_state import STATE_FILE, describe_age
+from agc_ui import load_ui_class
+from agc_view import ViewModel, status_view
+
+SERIAL_PORT = '/dev/ttyS0'     # For use in field
 
 # Main Data String Array in bytes.
 # 0 "STX" byte is always 55(hex).
@@ -28,534 +39,280 @@ ser.timeout = 1
 # 3 "cmd" is the command number 1-13.
 # 4 "bcc" is the block checksum. This is the least significant 8 bits of the sum of bytes 1-3.
 
-# This is the main packet. It will change depending on commands.
-packet_to_send = bytearray([0x55, 0x01, 0x01, 0x01, 0x03])
-radar_position = pd.read_csv("/home/radar/UOL_scripts/Antenna_Positions_CSV/antenna_positions.csv")
+# Interval of the timer used to measure event loop latency in milliseconds.
+LOOP_LATENCY_INTERVAL = 10
+# Shown when a command is acknowledged, anything not listed shows "response good".
+REPLY_TEXT = {"ping": "Ping Good", "reset": "Micro reset"}
+# Background of a position in the position list while its breaker is not closed
+HEALTH_COLOURS = {SUSPECT: QColor("#ffe08a"), OPEN: QColor("#ff9a9a"), HALF_OPEN: QColor("#ffc38a")}
+
+
+# Replies arrive on the bus worker thread. Emitting them through a signal hands them to the GUI thread.
+class BusSignals(QObject):
+    reply = pyqtSignal(object, object)
+    health = pyqtSignal(object, object)
 
 
 # Setting up the User interface
-class AGCUI(QMainWindow):
-    def __init__(self):
+Ui_AGC_COMMANDER = load_ui_class()
+
+
+class AGCUI(QMainWindow, Ui_AGC_COMMANDER):
+    def __init__(self, port=SERIAL_PORT, fleet=None):
         super(AGCUI, self).__init__()
-        # Import my ui
-        uic.loadUi("agc_commander_ui.ui", self)
-        # Define widgets
-        self.response = self.findChild(QLabel, "response")
-        self.code_sent = self.findChild(QLabel, "code_sent")
-        self.code_received = self.findChild(QLabel, "code_received")
-        self.porta = self.findChild(QLabel, "port_A")
-        self.portb = self.findChild(QLabel, "port_B")
-        self.portc = self.findChild(QLabel, "port_C")
-        self.fifteen_value = self.findChild(QLabel, "fifteen_value")
-        self.five_value = self.findChild(QLabel, "five_value")
-        self.five_hundred_value = self.findChild(QLabel, "five_hundred_value")
-        self.minus_fifteen_value = self.findChild(QLabel, "minus_fifteen_value")
-        self.fifty_value = self.findChild(QLabel, "fifty_value")
-        self.temp_value = self.findChild(QLabel, "temp_value")
-        self.f_power = self.findChild(QLabel, "f_power_value")
-        self.r_power = self.findChild(QLabel, "r_power_value")
-
-        self.pos_select = self.findChild(QComboBox, "position_number")
-
-        self.current_time = self.findChild(QLCDNumber, "current_time")
-
-        self.auto_reset_enabled = self.findChild(QCheckBox, "auto_reset_enabled")
-        self.check_5 = self.findChild(QCheckBox, "check_5")
-        self.check_500 = self.findChild(QCheckBox, "check_500")
-        self.check_50 = self.findChild(QCheckBox, "check_50")
-        self.check_15 = self.findChild(QCheckBox, "check_15")
-        self.check_m15 = self.findChild(QCheckBox, "check_m15")
-        self.inhibit_on = self.findChild(QCheckBox, "inhibit_on")
-        self.relay_closed = self.findChild(QCheckBox, "relay_closed")
-        self.cap1_fitted = self.findChild(QCheckBox, "cap1_fitted")
-        self.cap2_fitted = self.findChild(QCheckBox, "cap2_fitted")
-        self.bad_duty = self.findChild(QCheckBox, "bad_duty")
-        self.agc_loop_closed = self.findChild(QCheckBox, "agc_loop_closed")
-        self.power_active = self.findChild(QCheckBox, "power_active")
-        self.bad_SWR = self.findChild(QCheckBox, "bad_SWR")
-
-        self.radar_position = self.findChild(QPushButton, "set_position")
-        self.c1opush = self.findChild(QPushButton, "open_c1")
-        self.c1cpush = self.findChild(QPushButton, "close_c1")
-        self.c2opush = self.findChild(QPushButton, "open_c2")
-        self.c2cpush = self.findChild(QPushButton, "close_c2")
-        self.reltpush = self.findChild(QPushButton, "trip_relay")
-        self.relrpush = self.findChild(QPushButton, "reset_relay")
-        self.agcopush = self.findChild(QPushButton, "open_agc")
-        self.agccpush = self.findChild(QPushButton, "close_agc")
-        self.pingpush = self.findChild(QPushButton, "ping_tx")
-        self.pstatus = self.findChild(QPushButton, "position_status")
-        self.enable_reset = self.findChild(QPushButton, "enable_reset")
-        self.disable_reset = self.findChild(QPushButton, "disable_reset")
-        self.reset_microcontroller = self.findChild(QPushButton, "reset_micro")
-        self.reset_all = self.findChild(QPushButton, "reset_all")
-
-        # actions
-        self.reltpush.clicked.connect(self.relay_tripped)
-        self.relrpush.clicked.connect(self.relay_reset)
-        self.pingpush.clicked.connect(self.position_pinged)
-        self.agcopush.clicked.connect(self.agc_open)
-        self.agccpush.clicked.connect(self.agc_closed)
-        self.c1opush.clicked.connect(self.c1_open)
-        self.c1cpush.clicked.connect(self.c1_closed)
-        self.c2opush.clicked.connect(self.c2_open)
-        self.c2cpush.clicked.connect(self.c2_closed)
+        # A bus worker owns each serial port so the window keeps repainting while commands run, and the ports
+        # work side by side. Every position is on port unless a fleet file says otherwise, see agc_fleet.py.
+        self.capture = None
+        if fleet is None:
+            # Traffic on the ports is recorded when AGC_CAPTURE names a file, see agc_capture.py
+            self.capture = CAPTURE_FILE and Capture(CAPTURE_FILE)
+            # The last known state of every position is kept between runs, see agc_state.py
+            if FLEET_FILE:
+                fleet = Fleet.load(FLEET_FILE, state_file=STATE_FILE, capture=self.capture)
+            else:
+                fleet = Fleet.single(port, load_addresses(), state_file=STATE_FILE, capture=self.capture)
+        self.fleet = fleet
+        # Every packet is built once at start up, packets[position][cmd] is ready to send.
+        self.packets = fleet.packets
+        self.bus_signals = BusSignals()
+        self.bus_signals.reply.connect(self.deliver_reply)
+        self.bus_signals.health.connect(self.show_health)
+        self.fleet.add_health_listener(self.bus_signals.health.emit)
+        self.fleet.start()
+        # Import my ui, compiled once and cached by agc_ui.py. Every widget is now an attribute named as in the .ui file
+        self.setupUi(self)
+        # Shorter names for some widgets
+        self.porta = self.port_A
+        self.portb = self.port_B
+        self.portc = self.port_C
+        self.f_power = self.f_power_value
+        self.r_power = self.r_power_value
+
+        self.pos_select = self.position_number
+        # The window lists positions 1-16, a fleet can have more or fewer
+        if self.pos_select.count() != len(self.packets):
+            self.pos_select.clear()
+            self.pos_select.addItems([str(position + 1) for position in range(len(self.packets))])
+        # A position is shown from what was last heard from it as soon as it is picked
+        self.pos_select.currentIndexChanged.connect(self.position_changed)
+
+        self.c1opush = self.open_c1
+        self.c1cpush = self.close_c1
+        self.c2opush = self.open_c2
+        self.c2cpush = self.close_c2
+        self.reltpush = self.trip_relay
+        self.relrpush = self.reset_relay
+        self.agcopush = self.open_agc
+        self.agccpush = self.close_agc
+        self.pingpush = self.ping_tx
+        self.pstatus = self.position_status
+        self.reset_microcontroller = self.reset_micro
+
+        # Timings of every bus transaction, opened from the status bar
+        self.diagnostics = DiagnosticsWindow(self.fleet)
+        self.diagnostics_button = QPushButton("Bus timings")
+        self.diagnostics_button.clicked.connect(self.diagnostics.show)
+        self.statusBar().addPermanentWidget(self.diagnostics_button)
+        # One command to several positions at once
+        self.batch = BatchWindow(self.fleet)
+        self.batch_button = QPushButton("Batch commands")
+        self.batch_button.clicked.connect(self.batch.show)
+        self.statusBar().addPermanentWidget(self.batch_button)
+        # Every position at once, clicking one picks it here
+        self.overview = OverviewWindow(self.fleet)
+        self.overview.picked.connect(self.pos_select.setCurrentIndex)
+        self.overview_button = QPushButton("Overview")
+        self.overview_button.clicked.connect(self.overview.show)
+        self.statusBar().addPermanentWidget(self.overview_button)
+        # Positions that are not answering, also marked in the position list
+        self.health_label = QLabel("All AGCs answering")
+        self.statusBar().addPermanentWidget(self.health_label)
+        self.unhealthy = {}
+
+        # actions, each button sends one command to the selected position
+        self.reltpush.clicked.connect(lambda: self.send_command("relay_trip"))
+        self.relrpush.clicked.connect(lambda: self.send_command("relay_reset"))
+        self.pingpush.clicked.connect(lambda: self.send_command("ping"))
+        self.agcopush.clicked.connect(lambda: self.send_command("agc_open"))
+        self.agccpush.clicked.connect(lambda: self.send_command("agc_close"))
+        self.c1opush.clicked.connect(lambda: self.send_command("cap1_open"))
+        self.c1cpush.clicked.connect(lambda: self.send_command("cap1_close"))
+        self.c2opush.clicked.connect(lambda: self.send_command("cap2_open"))
+        self.c2cpush.clicked.connect(lambda: self.send_command("cap2_close"))
         self.pstatus.clicked.connect(self.pos_status)
-        self.enable_reset.clicked.connect(self.auto_enable)
-        self.disable_reset.clicked.connect(self.auto_disable)
-        self.reset_microcontroller.clicked.connect(self.reset_mic)
+        self.enable_reset.clicked.connect(lambda: self.send_command("auto_reset_enable"))
+        self.disable_reset.clicked.connect(lambda: self.send_command("auto_reset_disable"))
+        self.reset_microcontroller.clicked.connect(lambda: self.send_command("reset"))
         self.reset_all.clicked.connect(self.reset_all_micros)
+        # Readings and flags only go to the widgets that change, together, at most 10 times a second
+        self.view = ViewModel(self)
         # Clock timers
+        self.current_time.setDigitCount(20)
         self.timer = QTimer()
         self.timer.timeout.connect(self.clock_current)
         # Timer and update part
         self.timer.start(1000)
         # Call the function clock_current
         self.clock_current()
-        # Show the app
+        # Event loop latency, the worst lateness of a fast timer since it was last reset
+        self.loop_latency_worst = 0.0
+        self.loop_latency_last = time.monotonic()
+        self.loop_latency_timer = QTimer()
+        self.loop_latency_timer.timeout.connect(self.check_loop_latency)
+        self.loop_latency_timer.start(LOOP_LATENCY_INTERVAL)
+        # Show the app, already filled in from the last known state
+        self.position_changed(self.pos_select.currentIndex())
         self.show()
 
     def clock_current(self):
         time_now = datetime.now()
         # Format to english style date
         formatted_time = time_now.strftime("%d-%m-%Y"   "  %T")
-        self.current_time.setDigitCount(20)
         self.current_time.display(formatted_time)
 
-    def position_pinged(self):
-        radar = (int(self.pos_select.currentText())-1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x0b
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
+    def check_loop_latency(self):
+        now = time.monotonic()
+        late = now - self.loop_latency_last - LOOP_LATENCY_INTERVAL / 1000
+        self.loop_latency_last = now
+        self.loop_latency_worst = max(self.loop_latency_worst, late)
+
+    def closeEvent(self, event):
+        # The overview stops sweeping once it is closed
+        self.overview.close()
+        self.fleet.stop()
+        self.fleet.state.save()
+        if self.capture:
+            self.capture.close()
+        self.diagnostics.close()
+        self.batch.close()
+        super(AGCUI, self).closeEvent(event)
+
+    def transact(self, position, packet, reply_handler, expect_reply=True, priority=None):
+        # Queue the packet on the bus of position, reply_handler(reply) is then called on the GUI thread. Without a
+        # priority it goes ahead of any sweep as an operator's command, see agc_scheduler.py.
+        priority = interactive_priority(packet[3]) if priority is None else priority
+        self.fleet.submit(position, packet, lambda reply: self.bus_signals.reply.emit(reply_handler, reply),
+                          expect_reply, priority)
+
+    def after_all(self, reply_handler, priority=STATUS):
+        # reply_handler(reply) is called on the GUI thread once every bus has run everything of the priority
+        # queued before it.
+        self.fleet.after(lambda reply: self.bus_signals.reply.emit(reply_handler, reply), priority)
+
+    def deliver_reply(self, reply_handler, reply):
+        reply_handler(reply)
+
+    def show_exchange(self, reply):
+        tx = str(reply.packet.hex())
+        rx = str(reply.data.hex())
         readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.response.setText(f'Ping Good')
-        else:
-            self.response.setText(f" NO RESPONSE!")
-
-    def relay_tripped(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x03
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
         readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
         self.code_sent.setText(str(readout_tx))
         self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.relay_closed.setChecked(False)
-            self.response.setText(f"response good")
+        self.show_timing(reply.timing)
+
+    def show_timing(self, timing):
+        # Reply timing goes in the status bar so the gain over waiting out the timeout can be seen.
+        latency = f"event loop worst {self.loop_latency_worst * 1000:.0f} ms"
+        if timing.complete is not None:
+            self.statusBar().showMessage(f"first byte {timing.first_byte * 1000:.1f} ms, "
+                                         f"reply complete {timing.complete * 1000:.1f} ms, {latency}")
+        elif timing.first_byte is not None:
+            self.statusBar().showMessage(f"first byte {timing.first_byte * 1000:.1f} ms, reply incomplete, {latency}")
         else:
-            self.response.setText(f" NO RESPONSE!")
+            self.statusBar().showMessage(f"no reply before timeout, {latency}")
 
-    def relay_reset(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x02
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.relay_closed.setChecked(True)
-            self.response.setText(f"response good")
+    def show_health(self, position, node):
+        if position is None:
+            return
+        if node.state == HEALTHY:
+            self.unhealthy.pop(position, None)
         else:
-            self.response.setText(f" NO RESPONSE!")
-
-    def agc_open(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x05
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.agc_loop_closed.setChecked(False)
-            self.response.setText(f"response good")
-        else:
-            self.response.setText(f" NO RESPONSE!")
-
-    def agc_closed(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x04
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.agc_loop_closed.setChecked(True)
-            self.response.setText(f"response good")
+            self.unhealthy[position] = node
+        self.pos_select.setItemData(position, HEALTH_COLOURS.get(node.state), Qt.BackgroundRole)
+        self.pos_select.setItemData(position, describe(node, position), Qt.ToolTipRole)
+        if self.unhealthy:
+            self.health_label.setText("Not answering: " + ", ".join(
+                f"{position + 1} ({self.unhealthy[position].state})" for position in sorted(self.unhealthy)))
         else:
-            self.response.setText(f" NO RESPONSE!")
+            self.health_label.setText("All AGCs answering")
 
-    def c1_open(self):
+    def send_command(self, name):
         radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x07
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.cap1_fitted.setChecked(False)
-            self.response.setText(f"response good")
-        else:
-            self.response.setText(f" NO RESPONSE!")
-
-    def c1_closed(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x06
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.cap1_fitted.setChecked(True)
-            self.response.setText(f"response good")
+        command = COMMANDS_BY_NAME[name]
+        self.transact(radar, self.packets[radar][command.opcode],
+                      lambda reply: self.command_reply(command, reply, radar))
+
+    def position_changed(self, radar):
+        # Shows the last known state of the position straight away, and reads it again when that is old.
+        if radar < 0:
+            return
+        state = self.fleet.state
+        cached = state.status(radar)
+        if cached is not None:
+            self.show_status(cached.status)
+        # Commands answered since that status changed what it showed
+        for name, result in state.results_since(radar, cached.time if cached is not None else 0):
+            command = COMMANDS_BY_NAME.get(name)
+            if result.ok and command is not None:
+                self.view.update(dict(command.effects))
+        age = state.age(radar)
+        if age is None:
+            self.response.setText("no status yet, reading")
+        elif state.stale(radar):
+            self.response.setText(f"status from {describe_age(age)} ago, reading")
         else:
-            self.response.setText(f" NO RESPONSE!")
-
-    def c2_open(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x09
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.cap2_fitted.setChecked(False)
-            self.response.setText(f"response good")
-        else:
-            self.response.setText(f" NO RESPONSE!")
-
-    def c2_closed(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x08
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received == expected_response:
-            self.cap2_fitted.setChecked(True)
-            self.response.setText(f"response good")
-        else:
-            self.response.setText(f" NO RESPONSE!")
-
-    def pos_status(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x01
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        time.sleep(0.2)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:1]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-
-        if data_received[0:1] == expected_response:
-            self.response.setText("response as shown")
-            five = (int(readout_rx[4], 16))
-            five_hundred = (int(readout_rx[6], 16))
-            fifteen = (int(readout_rx[5], 16))
-            minus_fifteen = (int(readout_rx[7], 16))
-            fifty = (int(readout_rx[8], 16))
-            temp = readout_rx[9]
-            forward = readout_rx[10]
-            reflected = readout_rx[11]
-            self.temp_value.setText(str(temp))
-            self.f_power.setText(str(forward))
-            self.r_power.setText(str(reflected))
-            five_volts = (5 / 255)
-            value5 = round(((five * five_volts) * 2), 2)
-            self.five_value.setText(str(value5))
-
-            fifteen_volts = (15 / 255)
-            value15 = round(((fifteen * fifteen_volts) * 2), 2)
-            self.fifteen_value.setText(str(value15))
-
-            fifty_volts = (50 / 255)
-            value50 = round(((fifty * fifty_volts) * 2), 2)
-            self.fifty_value.setText(str(value50))
-
-            minus_fifteen_volts = (-15 / 255)
-            value15m = round(((minus_fifteen * minus_fifteen_volts) * 2), 2)
-            self.minus_fifteen_value.setText(str(value15m))
-
-            five_hundred_volts = (500 / 255)
-            value500 = round(((five_hundred * five_hundred_volts) * 2), 2)
-            self.five_hundred_value.setText(str(value500))
-
-            port_a = (readout_rx[12])
-            port_b = (readout_rx[13])
-            port_c = (readout_rx[14])
-            scale = 16
-            num_of_bits = 8
-            bin_porta = bin(int(port_a, scale))[2:].zfill(num_of_bits)
-            bin_portb = bin(int(port_b, scale))[2:].zfill(num_of_bits)
-            bin_portc = bin(int(port_c, scale))[2:].zfill(num_of_bits)
-            self.porta.setText(str(bin_porta))
-            self.portb.setText(str(bin_portb))
-            self.portc.setText(str(bin_portc))
-            print(bin_porta, bin_portb, bin_portc)
-
-            if bin_porta[7] == "1":
-                self.relay_closed.setChecked(True)
-            else:
-                self.relay_closed.setChecked(False)
-            if bin_porta[6] == "1":
-                self.inhibit_on.setChecked(True)
-            else:
-                self.inhibit_on.setChecked(False)
-            if bin_porta[5] == "1":
-                self.power_active.setChecked(True)
+            self.response.setText(f"status from {describe_age(age)} ago")
+        if state.stale(radar):
+            status = COMMANDS_BY_NAME["status"]
+            self.transact(radar, self.packets[radar][status.opcode],
+                          lambda reply: self.command_reply(status, reply, radar), priority=STATUS)
+
+    def command_reply(self, command, reply, radar=None):
+        # A reply for a position that is no longer selected is only kept in the last known state
+        if radar is not None and radar != self.pos_select.currentIndex():
+            return
+        self.show_exchange(reply)
+        if reply_ok(reply.packet, reply.data):
+            self.view.update(dict(command.effects))
+            if command.decode is not None:
+                self.response.setText("response as shown")
+                self.show_status(command.decode(reply.data))
             else:
-                self.power_active.setChecked(False)
-            if bin_portb[5] == "1":
-                self.cap1_fitted.setChecked(True)
-            else:
-                self.cap1_fitted.setChecked(False)
-            if bin_portb[4] == "1":
-                self.cap2_fitted.setChecked(True)
-            else:
-                self.cap2_fitted.setChecked(False)
-            if bin_portb[3] == "1":
-                self.agc_loop_closed.setChecked(True)
-            else:
-                self.agc_loop_closed.setChecked(False)
-            if bin_portc[7] == "1":
-                self.bad_duty.setChecked(False)
-            else:
-                self.bad_duty.setChecked(True)
-            if bin_portc[6] == "1":
-                self.bad_SWR.setChecked(False)
-            else:
-                self.bad_SWR.setChecked(True)
-            if bin_portc[5] == "1":
-                self.check_5.setChecked(True)
-            else:
-                self.check_5.setChecked(False)
-            if bin_portc[4] == "1":
-                self.check_15.setChecked(True)
-            else:
-                self.check_15.setChecked(False)
-            if bin_portc[3] == "1":
-                self.check_500.setChecked(True)
-            else:
-                self.check_500.setChecked(False)
-            if bin_portc[2] == "1":
-                self.check_m15.setChecked(True)
-            else:
-                self.check_m15.setChecked(False)
-            if bin_portc[1] == "1":
-                self.check_50.setChecked(True)
+                self.response.setText(REPLY_TEXT.get(command.name, "response good"))
         else:
-            self.response.setText("NO Response!!!")
+            self.response.setText(" NO RESPONSE!")
+        # A reset puts the micro back to its defaults, so read back what it really is now
+        if command.name == "reset":
+            self.pos_status()
 
-    def reset_mic(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x0a
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
+    def pos_status(self):
+        self.send_command("status")
 
-        if data_received == expected_response:
-            self.response.setText(f"Micro reset")
-            self.relay_closed.setChecked(True)
-            self.agc_loop_closed.setChecked(True)
-            self.cap1_fitted.setChecked(True)
-            self.cap2_fitted.setChecked(False)
-            self.auto_reset_enabled.setChecked(False)
-        else:
-            self.response.setText(f"no response")
-        self.pos_status()
+    def show_status(self, status):
+        # Only the readings and flags that differ from what is on screen are set, see agc_view.py
+        self.view.update(status_view(status))
 
     def reset_all_micros(self):
         self.response.setText(f"Please wait")
-        for radar in range(16):
-            true_radar_position = (radar_position.loc[radar].at['agc'])
-            rad_value = int(true_radar_position, 16)
-            packet_to_send[1] = (rad_value)
-            packet_to_send[3] = 0x0a
-            packet_to_send[4] = (sum(packet_to_send[1:4]))
-            ser.write(packet_to_send)
-        self.response.setText(f"ALL MICROCONTROLLERS RESET")
-
-    def auto_enable(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x0c
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
-        if data_received == expected_response:
-            self.auto_reset_enabled.setChecked(True)
+        # Every acknowledgement is checked and the resets that did not land are sent again
+        self.fleet.batch(COMMANDS_BY_NAME["reset"].opcode, range(len(self.packets)),
+                         lambda results: self.bus_signals.reply.emit(self.reset_all_micros_reply, results))
+
+    def reset_all_micros_reply(self, results):
+        failed = [str(result.position + 1) for result in results if not result.ok]
+        if failed:
+            self.response.setText(f"RESET, NO RESPONSE FROM {', '.join(failed)}")
         else:
-            self.response.setText(f"no response")
+            self.response.setText(f"ALL MICROCONTROLLERS RESET")
 
-    def auto_disable(self):
-        radar = (int(self.pos_select.currentText()) - 1)
-        true_radar_position = (radar_position.loc[radar].at['agc'])
-        rad_value = int(true_radar_position, 16)
-        packet_to_send[1] = rad_value
-        packet_to_send[3] = 0x0d
-        packet_to_send[4] = (sum(packet_to_send[1:4]))
-        ser.write(packet_to_send)
-        data_received = ser.readall()
-        expected_response = packet_to_send[0:2]
-        data_received_conv = (data_received).hex()
-        tx_read = (packet_to_send).hex()
-        rx = str(data_received_conv)
-        tx = str(tx_read)
-        readout_rx = [rx[i:i + 2] for i in range(0, len(rx), 2)]
-        readout_tx = [tx[i:i + 2] for i in range(0, len(tx), 2)]
-        self.code_sent.setText(str(readout_tx))
-        self.code_received.setText(str(readout_rx))
 
-        if data_received == expected_response:
-            self.auto_reset_enabled.setChecked(False)
-        else:
-            self.response.setText(f"no response")
+def main():
+    app = QApplication(sys.argv)
+    UIWindow = AGCUI()
+    app.exec_()
 
 
 # Initialise
-app = QApplication(sys.argv)
-UIWindow = AGCUI()
-app.exec_()
+if __name__ == "__main__":
+    main()
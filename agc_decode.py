@@ -0,0 +1,48 @@
+# AGC status decoding in bulk for python
+# Decodes any number of status (0x01) replies at once into a NumPy structured array, for captures and
+# log archives. Every reading is one byte, so all of the scaling is done by indexing 256 entry tables
+# built once from the same RAILS and FLAGS that agc_protocol.decode_status uses.
+
+import numpy as np
+
+from agc_protocol import (BCC_LENGTH, FLAGS, FORWARD, HEADER_LENGTH, PORT_A, PORT_B, PORT_C, RAILS, REFLECTED,
+                          STATUS_DATA_LENGTH, STATUS_LENGTH, STX, TEMP)
+
+RAW_READINGS = (("temp", TEMP), ("forward", FORWARD), ("reflected", REFLECTED),
+                ("port_a", PORT_A), ("port_b", PORT_B), ("port_c", PORT_C))
+
+# valid is False for any frame with a bad STX, Len or bcc, its other fields are then meaningless.
+STATUS_DTYPE = np.dtype([("valid", np.bool_), ("address", np.uint8)] +
+                        [(name, np.float32) for name, offset, volts in RAILS] +
+                        [(name, np.uint8) for name, offset in RAW_READINGS] +
+                        [(name, np.bool_) for name, offset, bit, inverted in FLAGS])
+
+_codes = np.arange(256)
+RAIL_TABLES = {name: np.round(_codes * (volts / 255) * 2, 2).astype(np.float32) for name, offset, volts in RAILS}
+FLAG_TABLES = {name: ((_codes >> bit & 1) == 1) != inverted for name, offset, bit, inverted in FLAGS}
+
+
+def as_frames(frames):
+    # Accepts one frame as bytes, a sequence of frames, a buffer of frames back to back, or an
+    # (n, STATUS_LENGTH) uint8 array, and returns the (n, STATUS_LENGTH) array without copying where it can.
+    if isinstance(frames, np.ndarray):
+        return frames.reshape(-1, STATUS_LENGTH).astype(np.uint8, copy=False)
+    if isinstance(frames, (bytes, bytearray, memoryview)):
+        return np.frombuffer(frames, dtype=np.uint8).reshape(-1, STATUS_LENGTH)
+    return np.frombuffer(b"".join(frames), dtype=np.uint8).reshape(-1, STATUS_LENGTH)
+
+
+def decode_status_batch(frames):
+    frames = as_frames(frames)
+    out = np.empty(len(frames), dtype=STATUS_DTYPE)
+    checksum = frames[:, 1:STATUS_LENGTH - BCC_LENGTH].sum(axis=1, dtype=np.uint32) & 0xFF
+    out["valid"] = ((frames[:, 0] == STX) & (frames[:, HEADER_LENGTH - 1] == STATUS_DATA_LENGTH)
+                    & (checksum == frames[:, -1]))
+    out["address"] = frames[:, 1]
+    for name, offset, volts in RAILS:
+        out[name] = RAIL_TABLES[name][frames[:, offset]]
+    for name, offset in RAW_READINGS:
+        out[name] = frames[:, offset]
+    for name, offset, bit, inverted in FLAGS:
+        out[name] = FLAG_TABLES[name][frames[:, offset]]
+    return out
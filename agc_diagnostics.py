@@ -0,0 +1,98 @@
+# AGC bus diagnostics window
+# Shows the timing histograms the bus workers keep (see agc_metrics.py) for every position and command, with
+# how long each bus currently waits for each reply (see agc_timeouts.py) and how deep each bus's queue is and how
+# long requests wait in it (see agc_scheduler.py), refreshed every second while it is open, and saves them to a
+# JSON file.
+
+from datetime import datetime
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QFileDialog, QHBoxLayout, QLabel, QPushButton, QTableWidget, QTableWidgetItem, \
+    QVBoxLayout, QWidget
+
+from agc_protocol import COMMANDS_BY_OPCODE
+from agc_scheduler import PRIORITY_NAMES
+
+COLUMNS = ("Position", "Bus", "Address", "Command", "Count", "Timeouts", "Wait", "Response p50",
+           "Round trip p50", "p90", "p99", "Max")
+
+
+def milliseconds(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+
+def describe_queue(name, summary):
+    # One line for a bus's queue, from TransactionQueue.summary.
+    if summary is None:
+        return f"{name}: queued at the broker"
+    classes = ", ".join(f"{class_name} {summary[class_name]['depth']} waiting "
+                        f"(most {summary[class_name]['max_depth']}, wait p99 "
+                        f"{milliseconds(summary[class_name]['wait']['p99'])})" for class_name in PRIORITY_NAMES)
+    return f"{name}: {classes}, {summary['promoted']} background let ahead"
+
+
+class DiagnosticsWindow(QWidget):
+    def __init__(self, fleet):
+        super(DiagnosticsWindow, self).__init__()
+        self.fleet = fleet
+        self.setWindowTitle("AGC bus timings")
+        self.resize(960, 480)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.queues = QLabel()
+        self.total = QLabel()
+        self.dump_button = QPushButton("Save to file")
+        self.dump_button.clicked.connect(self.dump)
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.total)
+        buttons.addStretch()
+        buttons.addWidget(self.dump_button)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addWidget(self.queues)
+        layout.addLayout(buttons)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start(1000)
+        super(DiagnosticsWindow, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(DiagnosticsWindow, self).hideEvent(event)
+
+    def refresh(self):
+        rows = []
+        for group, bus in zip(self.fleet.groups, self.fleet.buses):
+            for (opcode, address), timings in bus.metrics.summary().items():
+                rows.append((self.fleet.position_of.get((bus, address)), group.name, bus, opcode, address, timings))
+        # Sorted by position then command, addresses that are not in the fleet go last
+        rows.sort(key=lambda row: (len(self.fleet.addresses) if row[0] is None else row[0], row[1], row[3], row[4]))
+        self.table.setRowCount(len(rows))
+        transactions = 0
+        for row, (position, name, bus, opcode, address, timings) in enumerate(rows):
+            round_trip = timings["round_trip"]
+            command = COMMANDS_BY_OPCODE.get(opcode)
+            count = timings["write"]["count"]
+            transactions += count
+            cells = ("-" if position is None else str(position + 1), name, f"{address:02x}",
+                     f"{opcode:02x}" if command is None else command.name, str(count), str(timings["timeouts"]),
+                     milliseconds(bus.profile.timeout(opcode, address)),
+                     milliseconds(timings["response"]["p50"]), milliseconds(round_trip["p50"]),
+                     milliseconds(round_trip["p90"]), milliseconds(round_trip["p99"]), milliseconds(round_trip["max"]))
+            for column, text in enumerate(cells):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        self.total.setText(f"{transactions} transactions")
+        self.queues.setText("\n".join(describe_queue(group.name, bus.queue_summary())
+                                      for group, bus in zip(self.fleet.groups, self.fleet.buses)))
+
+    def dump(self):
+        default = datetime.now().strftime("bus_timings_%Y%m%d_%H%M%S.json")
+        path, _ = QFileDialog.getSaveFileName(self, "Save bus timings", default, "JSON (*.json)")
+        if path:
+            self.fleet.dump_metrics(path)
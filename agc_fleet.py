@@ -0,0 +1,195 @@
+# AGC fleet for python
+# Antenna positions can be spread over several serial ports, a group of positions or a whole radar's
+# antenna_positions.csv on each. Every port gets its own bus worker, so the buses run side by side, while
+# positions are numbered across the whole fleet in the order the buses are configured. A fleet file is JSON:
+#
+#   {"buses": [{"port": "/dev/ttyS0", "positions": "antenna_positions.csv", "rows": [1, 8]},
+#              {"port": "/dev/ttyS1", "positions": "antenna_positions.csv", "rows": [9, 16]},
+#              {"port": "/dev/ttyUSB0", "positions": "/home/radar/north/antenna_positions.csv", "name": "north"}]}
+#
+# rows picks the first and last row of the csv file, counting from 1, every row is used when it is left out.
+# Relative paths are relative to the fleet file. Without a fleet file there is one bus with every position.
+
+import json
+import os
+import queue
+import threading
+from collections import namedtuple
+
+from agc_broker import open_bus
+from agc_health import BASE_BACKOFF, HealthTracker
+from agc_positions import load_addresses
+from agc_protocol import build_packet_table, reply_ok
+from agc_scheduler import STATUS, interactive_priority
+from agc_state import StateCache
+from agc_timeouts import MAXIMUM, MINIMUM, STATE_DIRECTORY
+from agc_transport import TRANSPORT
+
+# AGC_FLEET in the environment points at the fleet file to use.
+FLEET_FILE = os.environ.get("AGC_FLEET")
+
+# Times a command is sent again to a position whose reply did not come back whole.
+BATCH_RETRIES = 2
+
+# One serial port and the AGC addresses on it, in position order.
+BusGroup = namedtuple("BusGroup", ["port", "addresses", "name"])
+# The outcome of one position in a batch: whether its reply was good, how many times the command was sent,
+# and the last reply.
+BatchResult = namedtuple("BatchResult", ["position", "ok", "attempts", "reply"])
+
+
+def load_groups(path):
+    with open(path) as fleet_file:
+        document = json.load(fleet_file)
+    directory = os.path.dirname(os.path.abspath(path))
+    groups = []
+    for bus in document["buses"]:
+        addresses = load_addresses(os.path.join(directory, bus["positions"]))
+        if "rows" in bus:
+            first, last = bus["rows"]
+            addresses = addresses[first - 1:last]
+        groups.append(BusGroup(bus["port"], addresses, bus.get("name", os.path.basename(bus["port"]))))
+    return groups
+
+
+class Fleet:
+    def __init__(self, groups, timeout=MAXIMUM, minimum=MINIMUM, profiles=STATE_DIRECTORY, base_backoff=BASE_BACKOFF,
+                 state_file=None, transport=TRANSPORT, capture=None):
+        # profiles is the directory the learned reply timeouts are kept in, None to keep nothing. state_file keeps
+        # the last known state of every position between runs, see agc_state.py. transport drives the serial
+        # ports, see agc_transport.py, and capture records their traffic, see agc_capture.py.
+        self.groups = tuple(groups)
+        # A port can also be a broker sharing the serial port with other programs, see agc_broker.py
+        self.buses = tuple(open_bus(group.port, timeout, minimum, profiles, HealthTracker(base_backoff=base_backoff),
+                                    transport, capture) for group in self.groups)
+        # Everything below is indexed by the position across the fleet, counting from 0
+        self.addresses = tuple(address for group in self.groups for address in group.addresses)
+        self.bus_of = tuple(bus for bus, group in zip(self.buses, self.groups) for _ in group.addresses)
+        self.name_of = tuple(group.name for group in self.groups for _ in group.addresses)
+        # packets[position][opcode] is ready to send, as for a single bus
+        self.packets = build_packet_table(self.addresses)
+        # The same address can be on more than one bus, so positions are looked up by bus and address
+        self.position_of = {(bus, address): position
+                            for position, (bus, address) in enumerate(zip(self.bus_of, self.addresses))}
+        # The latest reply to every command sent through the fleet
+        self.state = StateCache(self.addresses, path=state_file)
+
+    @classmethod
+    def load(cls, path, **options):
+        return cls(load_groups(path), **options)
+
+    @classmethod
+    def single(cls, port, addresses, **options):
+        return cls([BusGroup(port, tuple(addresses), os.path.basename(port))], **options)
+
+    def start(self):
+        for bus in self.buses:
+            bus.start()
+
+    def stop(self):
+        for bus in self.buses:
+            bus.stop()
+
+    def join(self):
+        for bus in self.buses:
+            bus.join()
+
+    def submit(self, position, packet, callback=None, expect_reply=True, priority=STATUS):
+        def done(reply):
+            if expect_reply:
+                self.state.record(position, reply)
+            if callback is not None:
+                callback(reply)
+
+        self.bus_of[position].submit(packet, done, expect_reply, priority)
+
+    def call(self, position, packet, expect_reply=True, priority=STATUS):
+        reply = self.bus_of[position].call(packet, expect_reply, priority)
+        if expect_reply:
+            self.state.record(position, reply)
+        return reply
+
+    def after(self, callback, priority=STATUS):
+        # callback(reply) once every bus has finished everything of the priority queued before this, called on the
+        # thread of the bus that finishes last with that bus's empty reply.
+        remaining = [len(self.buses)]
+        lock = threading.Lock()
+
+        def done(reply):
+            with lock:
+                remaining[0] -= 1
+                last = not remaining[0]
+            if last:
+                callback(reply)
+
+        for bus in self.buses:
+            bus.submit(b"", done, expect_reply=False, priority=priority)
+
+    def batch(self, opcode, positions, callback, retries=BATCH_RETRIES, priority=None):
+        # Sends opcode to every one of positions, each bus running its share back to back and all the buses at
+        # once. Every reply is checked, and positions without a good one are sent the command again, up to
+        # retries more times. callback(results) then gets a BatchResult for each position, in the order given,
+        # on the thread of the last bus to finish. Without a priority the batch runs as an operator's command,
+        # sweeps pass BACKGROUND.
+        positions = list(positions)
+        priority = interactive_priority(opcode) if priority is None else priority
+        results = {}
+
+        def attempt(tries, batch_positions):
+            replies = {}
+            for position in batch_positions:
+                self.submit(position, self.packets[position][opcode],
+                            lambda reply, position=position: replies.__setitem__(position, reply), True, priority)
+            self.after(lambda reply: finished(tries, batch_positions, replies), priority)
+
+        def finished(tries, batch_positions, replies):
+            failed = []
+            for position in batch_positions:
+                reply = replies[position]
+                results[position] = BatchResult(position, reply_ok(reply.packet, reply.data), tries, reply)
+                if not results[position].ok:
+                    failed.append(position)
+            if failed and tries <= retries:
+                attempt(tries + 1, failed)
+            else:
+                callback([results[position] for position in positions])
+
+        if positions:
+            attempt(1, positions)
+        else:
+            callback([])
+
+    def call_batch(self, opcode, positions=None, retries=BATCH_RETRIES, priority=None):
+        # batch() for callers that are happy to block, returns the results.
+        positions = range(len(self.addresses)) if positions is None else positions
+        done = queue.Queue(maxsize=1)
+        self.batch(opcode, positions, done.put, retries, priority)
+        return done.get()
+
+    def call_all(self, opcode, positions=None, priority=None):
+        # Sends opcode once to every position (or those given) with all the buses working at once, and returns the
+        # replies in the same order once they are all in.
+        return [result.reply for result in self.call_batch(opcode, positions, 0, priority)]
+
+    def allow(self, position):
+        # Whether a sweep should ask this position, from the circuit breaker of its bus (see agc_health.py).
+        return self.bus_of[position].health.allow(self.addresses[position])
+
+    def add_health_listener(self, listener):
+        # listener(position, node) whenever a position changes state, on the thread of its bus.
+        for bus in self.buses:
+            bus.health.add_listener(lambda node, bus=bus: listener(self.position_of.get((bus, node.address)), node))
+
+    def save_profiles(self):
+        for bus in self.buses:
+            bus.profile.save()
+
+    def dump_metrics(self, path):
+        # The timings of every bus as JSON, keyed by bus name then as BusMetrics.dump, with the depth and waits of
+        # its queue under "queue" (null for a broker's client, the broker keeps those).
+        document = {}
+        for group, bus in zip(self.groups, self.buses):
+            document[group.name] = bus.metrics.document()
+            document[group.name]["queue"] = bus.queue_summary()
+        with open(path, "w") as dump_file:
+            json.dump(document, dump_file, indent=1)
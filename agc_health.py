@@ -0,0 +1,141 @@
+# AGC node health for python
+# A circuit breaker for every AGC address, so a transmitter that is powered down stops costing a reply timeout
+# on every sweep. Each address is:
+#   healthy    answering
+#   suspect    has missed a reply or two, still asked every sweep
+#   open       missed FAILURES_TO_OPEN replies in a row, left out of sweeps until its next probe is due
+#   half-open  a probe is due or on its way, one reply closes the breaker again and one miss reopens it
+# The wait between probes doubles every time a probe goes unanswered, up to a maximum.
+
+import threading
+import time
+from collections import namedtuple
+
+HEALTHY = "healthy"
+SUSPECT = "suspect"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+FAILURES_TO_OPEN = 3
+BASE_BACKOFF = 60.0
+MAX_BACKOFF = 3600.0
+
+
+# The health of one address. failures is the replies missed in a row, backoff the seconds from the last miss
+# to the next probe while open, retry_at the time.monotonic() of that probe and changed the time.time() of the
+# last change of state.
+NodeHealth = namedtuple("NodeHealth", ["address", "state", "failures", "backoff", "retry_at", "changed"])
+
+
+def new_node(address):
+    return NodeHealth(address, HEALTHY, 0, 0.0, None, time.time())
+
+
+class HealthTracker:
+    # Replies are recorded by the bus worker, sweeps ask whether to send from their own thread, so every
+    # access takes the lock. Listeners are called as listener(node) on the recording thread whenever an address
+    # changes state.
+    def __init__(self, failures_to_open=FAILURES_TO_OPEN, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.failures_to_open = failures_to_open
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.nodes = {}
+        # Addresses allow() has let a probe through for, until it is sent
+        self.probes = set()
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def node(self, address):
+        with self.lock:
+            return self.nodes.get(address) or new_node(address)
+
+    def allow(self, address, now=None):
+        # True when a sweep should ask this address. An open breaker lets one probe through once it is due.
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            node = self.nodes.get(address)
+            if node is None or node.state in (HEALTHY, SUSPECT):
+                return True
+            if now < node.retry_at:
+                return False
+            # Allowed again after another backoff, in case the reply to this probe is never recorded
+            node = self.nodes[address] = node._replace(retry_at=now + node.backoff)
+            self.probes.add(address)
+            if node.state == HALF_OPEN:
+                return True
+            node = self.nodes[address] = node._replace(state=HALF_OPEN, changed=time.time())
+        self.notify(node)
+        return True
+
+    def take_probe(self, address, now=None):
+        # True when the request about to be sent to address is the probe of its open breaker: the one allow() let
+        # through, or the first request once the probe is due on a bus nobody sweeps. Anything else sent to an
+        # open breaker is not a probe.
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            node = self.nodes.get(address)
+            if node is None or node.state in (HEALTHY, SUSPECT):
+                self.probes.discard(address)
+                return False
+            if address in self.probes:
+                self.probes.remove(address)
+                return True
+            if now < node.retry_at:
+                return False
+        self.allow(address, now)
+        with self.lock:
+            self.probes.discard(address)
+        return True
+
+    def record(self, address, answered, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            before = self.nodes.get(address) or new_node(address)
+            if answered:
+                node = before._replace(state=HEALTHY, failures=0, backoff=0.0, retry_at=None)
+            else:
+                node = before._replace(failures=before.failures + 1)
+                if before.state == HALF_OPEN:
+                    backoff = min(self.max_backoff, before.backoff * 2)
+                    node = node._replace(state=OPEN, backoff=backoff, retry_at=now + backoff)
+                elif before.state != OPEN and node.failures >= self.failures_to_open:
+                    node = node._replace(state=OPEN, backoff=self.base_backoff, retry_at=now + self.base_backoff)
+                elif before.state == HEALTHY:
+                    node = node._replace(state=SUSPECT)
+            if node.state != before.state:
+                node = node._replace(changed=time.time())
+            self.nodes[address] = node
+        if node.state != before.state:
+            self.notify(node)
+
+    def notify(self, node):
+        for listener in self.listeners:
+            listener(node)
+
+    def counts(self):
+        # {state: number of addresses}, for the addresses that have been asked anything.
+        with self.lock:
+            counts = {}
+            for node in self.nodes.values():
+                counts[node.state] = counts.get(node.state, 0) + 1
+            return counts
+
+
+def describe_state(node):
+    # The state of node in words, e.g. "open after 3 missed replies, next probe in 120 s".
+    if node.state == OPEN:
+        return f"open after {node.failures} missed replies, next probe in {node.backoff:.0f} s"
+    if node.state == HALF_OPEN:
+        return "half-open, probing"
+    if node.state == SUSPECT:
+        return f"suspect, {node.failures} missed replies"
+    return "healthy"
+
+
+def describe(node, position=None):
+    # One line for logs and the status bar, e.g. "AGC 4 (13) open after 3 missed replies, next probe in 120 s".
+    name = f"AGC {node.address:02x}" if position is None else f"AGC {position + 1} ({node.address:02x})"
+    return f"{name} {describe_state(node)}"
@@ -0,0 +1,119 @@
+# AGC telemetry history for python
+# Keeps every status reply in an SQLite database, for questions like "what was position 7's reflected power and
+# temperature over the last month" that the ring buffer files (a week) and log_file.txt (free text) can't answer:
+#
+#   python agc_history.py telemetry.sqlite3 --pos 7 --days 30 reflected temp
+#
+# One narrow row per reply: the position (from 0, as the packet table), the time in ns since the epoch, whether it
+# answered, the raw status frame and the readings and port bytes from it as integers. The primary key is
+# (position, time) and the table is WITHOUT ROWID, so the rows of a position are stored in time order and a range of
+# them is one contiguous read. The database is in WAL mode, so readers (another connection, another program) go on
+# reading while the logger writes. Replies are added with append() and written with commit(), a whole sweep in one
+# transaction.
+
+import argparse
+import csv
+import sqlite3
+import sys
+import time
+
+from agc_protocol import FIVE, FIFTEEN, FIVE_HUNDRED, FORWARD, MINUS_FIFTEEN, FIFTY, PORT_A, PORT_B, PORT_C, \
+    REFLECTED, STATUS_LENGTH, TEMP
+
+# The readings kept from each frame, as (column, offset in the frame)
+READINGS = (("five", FIVE), ("fifteen", FIFTEEN), ("five_hundred", FIVE_HUNDRED), ("minus_fifteen", MINUS_FIFTEEN),
+            ("fifty", FIFTY), ("temp", TEMP), ("forward", FORWARD), ("reflected", REFLECTED), ("port_a", PORT_A),
+            ("port_b", PORT_B), ("port_c", PORT_C))
+COLUMNS = ("position", "time", "responded", "frame") + tuple(name for name, offset in READINGS)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS status (
+    position INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    responded INTEGER NOT NULL,
+    frame BLOB,
+    {", ".join(f"{name} INTEGER" for name, offset in READINGS)},
+    PRIMARY KEY (position, time)
+) WITHOUT ROWID
+"""
+INSERT = f"INSERT OR REPLACE INTO status VALUES ({', '.join('?' * len(COLUMNS))})"
+NANOSECONDS = 1000000000
+
+
+def status_row(position, frame, timestamp):
+    # frame is the status reply, or None when the position did not answer.
+    if frame is None:
+        return (position, timestamp, 0, None) + (None,) * len(READINGS)
+    frame = bytes(frame[:STATUS_LENGTH])
+    return (position, timestamp, 1, frame) + tuple(frame[offset] for name, offset in READINGS)
+
+
+class TelemetryHistory:
+    def __init__(self, path, writable=True):
+        self.path = path
+        self.writable = writable
+        if writable:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode a commit can only be lost to a power cut, never corrupt the database
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(SCHEMA)
+            self.connection.commit()
+        else:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        self.pending = []
+
+    def append(self, position, frame, timestamp=None):
+        # Kept until commit(), as TelemetryStore.append otherwise.
+        self.pending.append(status_row(position, frame, time.time_ns() if timestamp is None else timestamp))
+
+    def commit(self):
+        # Everything appended since the last commit, in one transaction.
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(INSERT, self.pending)
+        self.pending = []
+
+    def readings(self, position, start=None, end=None, columns=("time",) + tuple(name for name, offset in READINGS)):
+        # The columns of every reply from position with start <= time < end (ns since the epoch, either can be left
+        # out), oldest first.
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown columns {', '.join(sorted(unknown))}")
+        return self.connection.execute(
+            f"SELECT {', '.join(columns)} FROM status WHERE position = ? AND time >= ? AND time < ? ORDER BY time",
+            (position, -2 ** 63 if start is None else start, 2 ** 63 - 1 if end is None else end)).fetchall()
+
+    def close(self):
+        if self.writable:
+            self.commit()
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Readings of one position from the telemetry history, as CSV")
+    parser.add_argument("database")
+    parser.add_argument("columns", nargs="*", default=[name for name, offset in READINGS],
+                        help=f"any of {', '.join(name for name, offset in READINGS)} (all by default)")
+    parser.add_argument("--pos", type=int, required=True, help="antenna position, 1 upwards")
+    parser.add_argument("--days", type=float, help="only the last this many days")
+    args = parser.parse_intermixed_args()
+
+    history = TelemetryHistory(args.database, writable=False)
+    start = None if args.days is None else time.time_ns() - int(args.days * 86400 * NANOSECONDS)
+    try:
+        rows = history.readings(args.pos - 1, start, columns=["time", "responded"] + args.columns)
+    except ValueError as error:
+        parser.error(str(error))
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["time"] + args.columns)
+    for row in rows:
+        # A position that did not answer has no readings
+        writer.writerow([time.strftime("%d-%m-%Y %T", time.localtime(row[0] / NANOSECONDS))]
+                        + (list(row[2:]) if row[1] else [""] * len(args.columns)))
+    history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# AGC bus timing metrics for python
+# Every bus transaction is timed and kept in histograms per command and per AGC address, so a slow AGC can be
+# told apart from a dead one and it is clear where the time goes.
+#
+# The histograms work like HdrHistogram: values are counted in microseconds, exactly below 64 us and in 32
+# buckets per power of two above that, so any value is within about 3% and memory stays small however many
+# transactions are recorded.
+
+import json
+import threading
+
+SUB_BUCKETS = 32
+EXACT_BELOW = 2 * SUB_BUCKETS
+
+# write: writing the packet until it has left the port, response: from then to the first reply byte,
+# round_trip: from the start of the write to the complete reply.
+INTERVALS = ("write", "response", "round_trip")
+
+
+def bucket_index(value):
+    if value < EXACT_BELOW:
+        return value
+    shift = value.bit_length() - 6
+    return EXACT_BELOW + (shift - 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_lowest(index):
+    # The lowest value counted in the bucket.
+    if index < EXACT_BELOW:
+        return index
+    shift = (index - EXACT_BELOW) // SUB_BUCKETS + 1
+    return ((index - EXACT_BELOW) % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+
+def bucket_value(index):
+    # The middle of the range of values counted in the bucket.
+    if index < EXACT_BELOW:
+        return index
+    shift = (index - EXACT_BELOW) // SUB_BUCKETS + 1
+    return bucket_lowest(index) + ((1 << shift) - 1) / 2
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.lowest = None
+        self.highest = None
+
+    def record(self, seconds):
+        microseconds = max(0, int(seconds * 1e6))
+        index = bucket_index(microseconds)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.lowest = microseconds if self.lowest is None else min(self.lowest, microseconds)
+        self.highest = microseconds if self.highest is None else max(self.highest, microseconds)
+
+    def percentile(self, fraction):
+        # In seconds, None while the histogram is empty.
+        if not self.total:
+            return None
+        wanted = max(1, fraction * self.total)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(bucket_value(index), self.highest) / 1e6
+        return self.highest / 1e6
+
+    def summary(self):
+        return {"count": self.total,
+                "min": None if self.lowest is None else self.lowest / 1e6,
+                "p50": self.percentile(0.50), "p90": self.percentile(0.90), "p99": self.percentile(0.99),
+                "max": None if self.highest is None else self.highest / 1e6,
+                "buckets": [[bucket_value(index) / 1e6, self.counts[index]] for index in sorted(self.counts)]}
+
+
+class BusMetrics:
+    # Filled in by the bus worker and read from anywhere, so every access takes the lock.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.timeouts = {}
+
+    def record(self, opcode, address, timing):
+        # timing is the agc_bus.Timing of one transaction.
+        with self.lock:
+            key = (opcode, address)
+            if key not in self.histograms:
+                self.histograms[key] = {interval: LatencyHistogram() for interval in INTERVALS}
+                self.timeouts[key] = 0
+            histograms = self.histograms[key]
+            histograms["write"].record(timing.write_complete)
+            if timing.first_byte is not None:
+                histograms["response"].record(timing.first_byte - timing.write_complete)
+            if timing.complete is not None:
+                histograms["round_trip"].record(timing.complete)
+            else:
+                self.timeouts[key] += 1
+
+    def summary(self):
+        # {(opcode, address): {"write": {...}, "response": {...}, "round_trip": {...}, "timeouts": n}}
+        with self.lock:
+            return {key: dict({interval: histogram.summary() for interval, histogram in histograms.items()},
+                              timeouts=self.timeouts[key])
+                    for key, histograms in self.histograms.items()}
+
+    def document(self):
+        # The summary keyed by opcode then address, both as two digit hex, ready for JSON.
+        document = {}
+        for (opcode, address), summary in sorted(self.summary().items()):
+            document.setdefault(f"{opcode:02x}", {})[f"{address:02x}"] = summary
+        return document
+
+    def dump(self, path):
+        with open(path, "w") as dump_file:
+            json.dump(self.document(), dump_file, indent=1)
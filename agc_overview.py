@@ -0,0 +1,177 @@
+# AGC fleet overview window
+# One small tile per position with the relay, AGC loop, capacitors, alarms, rail checks and readings, all filled
+# in from the last known state (see agc_state.py). While the window is open the fleet is swept continuously at
+# background priority, so the operator's own commands still go first, and any reply from anywhere updates its
+# tile. A tile is only redrawn when what it shows has changed. Clicking a tile picks that position in the main
+# window.
+
+import time
+
+from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QPalette
+from PyQt5.QtWidgets import QCheckBox, QGridLayout, QHBoxLayout, QLabel, QScrollArea, QVBoxLayout, QWidget
+
+from agc_health import HALF_OPEN, OPEN, SUSPECT
+from agc_metrics import LatencyHistogram
+from agc_protocol import STATUS_COMMAND
+from agc_scheduler import BACKGROUND
+
+TILE_COLUMNS = 8
+# Pause between the end of one sweep and the start of the next
+SWEEP_PAUSE = 500
+GOOD = "#1a7f37"
+BAD = "#c62828"
+OFF = "#9e9e9e"
+TILE_COLOURS = {SUSPECT: QColor("#fff3c4"), OPEN: QColor("#ffd6d6"), HALF_OPEN: QColor("#ffe3c4")}
+# (name, label, whether set is good) for the states shown as words on a tile
+SWITCHES = (("relay_closed", "REL", True), ("agc_loop_closed", "AGC", True), ("cap1_fitted", "C1", True),
+            ("cap2_fitted", "C2", True))
+ALARMS = (("bad_SWR", "SWR", False), ("bad_duty", "DUTY", False))
+CHECKS = (("check_5", "5", True), ("check_15", "15", True), ("check_50", "50", True), ("check_m15", "-15", True),
+          ("check_500", "500", True))
+
+
+def flag_html(status, flags):
+    return " ".join(f'<span style="color:{GOOD if getattr(status, name) == good else BAD}">{label}</span>'
+                    for name, label, good in flags)
+
+
+def tile_html(title, status, answered, stale):
+    # The whole text of a tile, from what it shows.
+    if status is None:
+        body = f'<span style="color:{OFF}">no status yet</span>'
+    else:
+        body = (f"{flag_html(status, SWITCHES)}<br>{flag_html(status, ALARMS)}&nbsp; {flag_html(status, CHECKS)}<br>"
+                f"T {status.temp} &nbsp;F {status.forward} &nbsp;R {status.reflected}")
+        if stale:
+            body = f'<span style="color:{OFF}">{body}</span>'
+    if not answered:
+        title += f' <span style="color:{BAD}">NO RESPONSE</span>'
+    return f"<b>{title}</b><br>{body}"
+
+
+# Replies arrive on bus threads, the signals hand them to the GUI thread.
+class OverviewSignals(QObject):
+    changed = pyqtSignal(int)
+    swept = pyqtSignal(object)
+
+
+class Tile(QLabel):
+    picked = pyqtSignal(int)
+
+    def __init__(self, position, title):
+        super(Tile, self).__init__()
+        self.position = position
+        self.title = title
+        self.shown = None
+        self.setTextFormat(Qt.RichText)
+        self.setFrameShape(QLabel.StyledPanel)
+        self.setAutoFillBackground(True)
+        self.setMinimumWidth(150)
+        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.background = self.palette().color(QPalette.Window)
+
+    def show_state(self, view):
+        # view is (status, answered, stale, health state), nothing is done when it is what is already shown.
+        if view == self.shown:
+            return False
+        status, answered, stale, health = view
+        self.setText(tile_html(self.title, status, answered, stale))
+        palette = self.palette()
+        palette.setColor(QPalette.Window, TILE_COLOURS.get(health, self.background))
+        self.setPalette(palette)
+        self.shown = view
+        return True
+
+    def mousePressEvent(self, event):
+        self.picked.emit(self.position)
+        super(Tile, self).mousePressEvent(event)
+
+
+class OverviewWindow(QWidget):
+    picked = pyqtSignal(int)
+
+    def __init__(self, fleet):
+        super(OverviewWindow, self).__init__()
+        self.fleet = fleet
+        self.setWindowTitle("AGC overview")
+        self.resize(1280, 360)
+        self.signals = OverviewSignals()
+        self.signals.changed.connect(self.update_tile)
+        self.signals.swept.connect(self.sweep_done)
+        fleet.state.add_listener(self.signals.changed.emit)
+        # Time taken by each tile update, to keep an eye on the window staying responsive
+        self.update_times = LatencyHistogram()
+        self.sweeping = False
+
+        named = len(fleet.groups) > 1
+        self.tiles = []
+        grid_widget = QWidget()
+        grid = QGridLayout(grid_widget)
+        grid.setSpacing(4)
+        for position, address in enumerate(fleet.addresses):
+            title = f"{position + 1} ({address:02x})" + (f" {fleet.name_of[position]}" if named else "")
+            tile = Tile(position, title)
+            tile.picked.connect(self.picked.emit)
+            grid.addWidget(tile, position // TILE_COLUMNS, position % TILE_COLUMNS)
+            self.tiles.append(tile)
+        scroll = QScrollArea()
+        scroll.setWidget(grid_widget)
+        scroll.setWidgetResizable(True)
+        self.continuous = QCheckBox("Sweep continuously")
+        self.continuous.setChecked(True)
+        self.continuous.toggled.connect(self.start_sweep)
+        self.summary = QLabel()
+        bottom = QHBoxLayout()
+        bottom.addWidget(self.continuous)
+        bottom.addStretch()
+        bottom.addWidget(self.summary)
+        layout = QVBoxLayout(self)
+        layout.addWidget(scroll)
+        layout.addLayout(bottom)
+
+        # Tiles go grey when their status gets old even without a reply
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_all)
+
+    def showEvent(self, event):
+        self.update_all()
+        self.timer.start(1000)
+        self.start_sweep()
+        super(OverviewWindow, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(OverviewWindow, self).hideEvent(event)
+
+    def view(self, position, now):
+        state = self.fleet.state
+        cached = state.status(position)
+        result = state.result(position, "status")
+        health = self.fleet.bus_of[position].health.node(self.fleet.addresses[position]).state
+        return (None if cached is None else cached.status, result is None or result.ok,
+                cached is None or now - cached.time > state.ttl, health)
+
+    def update_tile(self, position):
+        started = time.perf_counter()
+        if self.tiles[position].show_state(self.view(position, time.time())):
+            self.update_times.record(time.perf_counter() - started)
+
+    def update_all(self):
+        for position in range(len(self.tiles)):
+            self.update_tile(position)
+        worst = self.update_times.highest
+        self.summary.setText(f"{self.update_times.total} tile updates" +
+                             ("" if worst is None else f", slowest {worst / 1000:.1f} ms"))
+
+    def start_sweep(self):
+        # One sweep at a time, the next starting SWEEP_PAUSE after the last one finished.
+        if self.sweeping or not self.continuous.isChecked() or not self.isVisible():
+            return
+        positions = [position for position in range(len(self.tiles)) if self.fleet.allow(position)]
+        self.sweeping = True
+        self.fleet.batch(STATUS_COMMAND, positions, self.signals.swept.emit, 0, BACKGROUND)
+
+    def sweep_done(self, results):
+        self.sweeping = False
+        QTimer.singleShot(SWEEP_PAUSE, self.start_sweep)
@@ -0,0 +1,15 @@
+# Antenna positions for python
+# The AGC address of each antenna position, read from the site's antenna_positions.csv with the csv module.
+
+import csv
+import os
+
+# AGC_POSITIONS_CSV in the environment points at another file, e.g. when working off site.
+POSITIONS_CSV = os.environ.get("AGC_POSITIONS_CSV",
+                               "/home/radar/UOL_scripts/Antenna_Positions_CSV/antenna_positions.csv")
+
+
+def load_addresses(path=POSITIONS_CSV):
+    # Addresses in file order, so position 1 is addresses[0]. The agc column holds hex strings.
+    with open(path, newline="") as csv_file:
+        return tuple(int(row["agc"], 16) for row in csv.DictReader(csv_file))
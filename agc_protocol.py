@@ -0,0 +1,211 @@
+# AGC protocol helpers for python
+# Every command the AGC microcontrollers understand is described once here, with the packets for every
+# position built up front. Replies are read one frame at a time, so a command returns as soon as its
+# reply is complete instead of waiting out the serial timeout.
+
+# Frames on the bus.
+# Command packet:  55 addr 01 cmd bcc
+# Acknowledgement: 55 addr
+# Status reply:    55 addr Len <Len bytes of data> bcc
+# "bcc" is the least significant 8 bits of the sum of every byte between the STX and the bcc.
+
+import time
+from collections import namedtuple
+
+STX = 0x55
+BITS_PER_BYTE = 10      # start bit, 8 data bits, stop bit
+STATUS_COMMAND = 0x01
+ACK_LENGTH = 2
+HEADER_LENGTH = 3       # STX, addr, Len
+BCC_LENGTH = 1
+STATUS_DATA_LENGTH = 12     # cmd echo then 11 bytes of readings
+STATUS_LENGTH = HEADER_LENGTH + STATUS_DATA_LENGTH + BCC_LENGTH
+
+# Offsets of the readings in a status frame
+FIVE = 4
+FIFTEEN = 5
+FIVE_HUNDRED = 6
+MINUS_FIFTEEN = 7
+FIFTY = 8
+TEMP = 9
+FORWARD = 10
+REFLECTED = 11
+PORT_A = 12
+PORT_B = 13
+PORT_C = 14
+
+# Rail readings are 0-255 across half of the nominal voltage.
+RAILS = (("five", FIVE, 5), ("fifteen", FIFTEEN, 15), ("five_hundred", FIVE_HUNDRED, 500),
+         ("minus_fifteen", MINUS_FIFTEEN, -15), ("fifty", FIFTY, 50))
+
+# Status flags as (name, port offset, bit, set when the bit is clear).
+# The names match the check boxes in the commander window.
+FLAGS = (("relay_closed", PORT_A, 0, False),
+         ("inhibit_on", PORT_A, 1, False),
+         ("power_active", PORT_A, 2, False),
+         ("cap1_fitted", PORT_B, 2, False),
+         ("cap2_fitted", PORT_B, 3, False),
+         ("agc_loop_closed", PORT_B, 4, False),
+         ("bad_duty", PORT_C, 0, True),
+         ("bad_SWR", PORT_C, 1, True),
+         ("check_5", PORT_C, 2, False),
+         ("check_15", PORT_C, 3, False),
+         ("check_500", PORT_C, 4, False),
+         ("check_m15", PORT_C, 5, False),
+         ("check_50", PORT_C, 6, False))
+
+# A decoded status reply. Rails are in volts, temp, forward and reflected are the raw readings.
+Status = namedtuple("Status", ["address"] + [rail[0] for rail in RAILS] +
+                    ["temp", "forward", "reflected", "port_a", "port_b", "port_c"] + [flag[0] for flag in FLAGS])
+
+# name, opcode, reply_length, decode(frame) for the reply data or None, and effects, the
+# (state, value) pairs known to hold once the command has been acknowledged.
+Command = namedtuple("Command", ["name", "opcode", "reply_length", "decode", "effects"])
+
+# Seconds from the end of the write to the first reply byte and to the complete frame.
+# Either is None when that point was never reached.
+ReplyTiming = namedtuple("ReplyTiming", ["first_byte", "complete"])
+
+
+def block_checksum(data):
+    return sum(data) & 0xFF
+
+
+class FrameParser:
+    # Incremental parser for one reply. Bytes can be fed in any sized pieces; anything that is not a
+    # valid frame (line noise, a stray STX, another address talking, a bad bcc) is skipped over.
+    # address=None accepts frames from any address, ack=True expects the 2 byte acknowledgement
+    # rather than a Len framed packet.
+
+    def __init__(self, address=None, ack=False):
+        self.address = address
+        self.ack = ack
+        self.buffer = bytearray()
+
+    def bytes_needed(self):
+        # Number of bytes that would complete the frame currently being assembled.
+        if self.ack:
+            return ACK_LENGTH - len(self.buffer)
+        if len(self.buffer) < HEADER_LENGTH:
+            return HEADER_LENGTH + BCC_LENGTH - len(self.buffer)
+        return HEADER_LENGTH + self.buffer[2] + BCC_LENGTH - len(self.buffer)
+
+    def feed(self, data):
+        # Returns the complete frame as bytes once it has arrived, otherwise None.
+        self.buffer += data
+        while True:
+            start = self.buffer.find(STX)
+            if start < 0:
+                del self.buffer[:]
+                return None
+            del self.buffer[:start]
+            if len(self.buffer) < 2:
+                return None
+            if self.address is not None and self.buffer[1] != self.address:
+                del self.buffer[:1]
+                continue
+            if self.ack:
+                frame = bytes(self.buffer[:ACK_LENGTH])
+                del self.buffer[:ACK_LENGTH]
+                return frame
+            if len(self.buffer) < HEADER_LENGTH:
+                return None
+            frame_length = HEADER_LENGTH + self.buffer[2] + BCC_LENGTH
+            if len(self.buffer) < frame_length:
+                return None
+            if block_checksum(self.buffer[1:frame_length - 1]) != self.buffer[frame_length - 1]:
+                del self.buffer[:1]
+                continue
+            frame = bytes(self.buffer[:frame_length])
+            del self.buffer[:frame_length]
+            return frame
+
+
+def read_reply(ser, packet_sent, timeout=None):
+    # Reads the reply to packet_sent. Each read asks for exactly the bytes still missing from the
+    # frame, so it returns the moment the frame is complete. timeout (the port timeout when None) bounds
+    # the wait for the first byte, the rest of the frame is then given twice its time on the line on top
+    # of that again. When the time is up whatever was received is returned unchanged so the caller can
+    # show it.
+    command = COMMANDS_BY_OPCODE[packet_sent[3]]
+    parser = FrameParser(packet_sent[1], ack=(command.reply_length == ACK_LENGTH))
+    if timeout is None:
+        timeout = ser.timeout
+    received = bytearray()
+    first_byte = None
+    start = time.monotonic()
+    deadline = start + timeout
+    # The port timeout is shortened for each read and put back after, so the next caller gets the one it set
+    port_timeout = ser.timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return bytes(received), ReplyTiming(first_byte, None)
+            ser.timeout = remaining
+            # The first byte is read on its own so its arrival time is known
+            chunk = ser.read(parser.bytes_needed() if received else 1)
+            if chunk:
+                if first_byte is None:
+                    first_byte = time.monotonic() - start
+                    deadline = start + first_byte + timeout + 2 * command.reply_length * BITS_PER_BYTE / ser.baudrate
+                received += chunk
+                frame = parser.feed(chunk)
+                if frame is not None:
+                    return frame, ReplyTiming(first_byte, time.monotonic() - start)
+    finally:
+        ser.timeout = port_timeout
+
+
+def decode_status(frame):
+    values = [frame[1]]
+    values += [round(frame[offset] * (volts / 255) * 2, 2) for name, offset, volts in RAILS]
+    values += [frame[offset] for offset in (TEMP, FORWARD, REFLECTED, PORT_A, PORT_B, PORT_C)]
+    values += [bool(frame[offset] >> bit & 1) != inverted for name, offset, bit, inverted in FLAGS]
+    return Status(*values)
+
+
+COMMANDS = (
+    Command("status", 0x01, STATUS_LENGTH, decode_status, ()),
+    Command("relay_reset", 0x02, ACK_LENGTH, None, (("relay_closed", True),)),
+    Command("relay_trip", 0x03, ACK_LENGTH, None, (("relay_closed", False),)),
+    Command("agc_close", 0x04, ACK_LENGTH, None, (("agc_loop_closed", True),)),
+    Command("agc_open", 0x05, ACK_LENGTH, None, (("agc_loop_closed", False),)),
+    Command("cap1_close", 0x06, ACK_LENGTH, None, (("cap1_fitted", True),)),
+    Command("cap1_open", 0x07, ACK_LENGTH, None, (("cap1_fitted", False),)),
+    Command("cap2_close", 0x08, ACK_LENGTH, None, (("cap2_fitted", True),)),
+    Command("cap2_open", 0x09, ACK_LENGTH, None, (("cap2_fitted", False),)),
+    Command("reset", 0x0a, ACK_LENGTH, None, (("relay_closed", True), ("agc_loop_closed", True),
+                                              ("cap1_fitted", True), ("cap2_fitted", False),
+                                              ("auto_reset_enabled", False))),
+    Command("ping", 0x0b, ACK_LENGTH, None, ()),
+    Command("auto_reset_enable", 0x0c, ACK_LENGTH, None, (("auto_reset_enabled", True),)),
+    Command("auto_reset_disable", 0x0d, ACK_LENGTH, None, (("auto_reset_enabled", False),)),
+)
+COMMANDS_BY_NAME = {command.name: command for command in COMMANDS}
+COMMANDS_BY_OPCODE = {command.opcode: command for command in COMMANDS}
+
+
+def encode(address, opcode):
+    body = bytes([address, 1, opcode])
+    return bytes([STX]) + body + bytes([block_checksum(body)])
+
+
+def build_packet_table(addresses):
+    # packets[position][opcode] is the ready to send packet, positions count from 0.
+    # Opcode 0 is unused and left as None.
+    return tuple(tuple(encode(address, opcode) if opcode in COMMANDS_BY_OPCODE else None
+                       for opcode in range(max(COMMANDS_BY_OPCODE) + 1))
+                 for address in addresses)
+
+
+def reply_ok(packet_sent, data):
+    # A reply is good when it is the whole frame the command expects from the address it was sent to.
+    command = COMMANDS_BY_OPCODE[packet_sent[3]]
+    if data[0:2] != packet_sent[0:2]:
+        return False
+    if command.reply_length == ACK_LENGTH:
+        return len(data) == ACK_LENGTH
+    # The Len field is trusted over STATUS_LENGTH, as long as every reading is there.
+    return (PORT_C < len(data) - BCC_LENGTH and len(data) == HEADER_LENGTH + data[2] + BCC_LENGTH
+            and block_checksum(data[1:-1]) == data[-1])
@@ -0,0 +1,183 @@
+# AGC capture replay for python
+# Plays back a capture file recorded with --capture or AGC_CAPTURE (see agc_capture.py), to see what went on the bus
+# after the fact or to run the commander against the same replies again:
+#
+#   python agc_replay.py decode agc.cap                       # every transaction, decoded
+#   python agc_replay.py decode agc.cap --speed 1             # as they happened
+#   python agc_replay.py serve agc.cap --link /tmp/agc_bus --speed 10
+#   python -m agc_commander poll --port /tmp/agc_bus
+#
+# serve answers on a pseudo terminal, as agc_simulator.py does, with what the capture has for the same packet: the
+# same bytes, as long after the packet as they came then, divided by --speed. A packet the capture never got an
+# answer to gets none, so the window, the command line and the benchmark see the same timeouts, corrupt replies and
+# slow nodes again. Once a packet has been sent more often than the capture has it, its replies start over.
+
+import argparse
+import os
+import signal
+import sys
+import time
+from collections import defaultdict, namedtuple
+
+from agc_capture import OPEN, RX, TX, WALL_CLOCK, read_capture
+from agc_cli import format_status
+from agc_positions import POSITIONS_CSV, load_addresses
+from agc_protocol import ACK_LENGTH, COMMANDS_BY_OPCODE, STATUS_COMMAND, FrameParser, decode_status, reply_ok
+from agc_simulator import BusSimulator
+
+# One packet written to a port and what was read back before the next. run counts the runs appended to the capture
+# from 0, sent is time.monotonic_ns() in that run as it was written, replies is (ns after sent, bytes) for every read.
+Exchange = namedtuple("Exchange", ["run", "port", "sent", "packet", "replies"])
+
+
+def load_exchanges(path):
+    # Every exchange in the capture in the order the packets were written, and for each run the difference between
+    # the wall clock and time.monotonic_ns() in it, to date its exchanges by. Monotonic times of different runs can't
+    # be compared, they may be from before and after a reboot.
+    exchanges = []
+    current = {}
+    ports = {}
+    runs = []
+    for timestamp, channel, kind, data in read_capture(path):
+        if kind == OPEN:
+            # Every run numbers its ports from 0, so channel 0 being opened again is the start of the next run
+            if channel == 0 or not runs:
+                runs.append(WALL_CLOCK.unpack_from(data)[0] - timestamp)
+                ports = {}
+                current = {}
+            ports[channel] = data[WALL_CLOCK.size:].decode(errors="replace")
+        elif kind == TX:
+            current[channel] = Exchange(len(runs) - 1, ports.get(channel, "?"), timestamp, data, [])
+            exchanges.append(current[channel])
+        elif kind == RX and channel in current:
+            current[channel].replies.append((timestamp - current[channel].sent, data))
+    return exchanges, runs
+
+
+def reply_frame(exchange):
+    # The reply frame and when its first byte and the whole frame had come, in ns after the packet. None for
+    # anything that is not there.
+    packet = exchange.packet
+    if len(packet) < 4 or packet[3] not in COMMANDS_BY_OPCODE or not exchange.replies:
+        return None, None, None
+    parser = FrameParser(packet[1], ack=(COMMANDS_BY_OPCODE[packet[3]].reply_length == ACK_LENGTH))
+    for offset, data in exchange.replies:
+        frame = parser.feed(data)
+        if frame is not None:
+            return frame, exchange.replies[0][0], offset
+    return None, exchange.replies[0][0], None
+
+
+def describe_exchange(exchange, start, positions):
+    # A line for the exchange, with the decoded status under it for a good status reply.
+    packet = exchange.packet
+    command = COMMANDS_BY_OPCODE.get(packet[3]) if len(packet) >= 4 else None
+    name = command.name if command else "?"
+    address = f"{packet[1]:02x}" if len(packet) >= 2 else "--"
+    frame, first_byte, complete = reply_frame(exchange)
+    received = b"".join(data for offset, data in exchange.replies)
+    if not received:
+        outcome = "NO RESPONSE"
+    elif complete is None:
+        outcome = f"BAD REPLY {received.hex(' ')}  first byte {first_byte / 1e6:.1f} ms"
+    else:
+        outcome = f"{'ok' if reply_ok(packet, frame) else 'BAD REPLY'} {frame.hex(' ')}  " \
+                  f"first byte {first_byte / 1e6:.1f} ms  complete {complete / 1e6:.1f} ms"
+    line = f"{(exchange.sent - start) / 1e9:10.3f}  {exchange.port}  {name:<18} addr {address}  {outcome}"
+    if command and command.opcode == STATUS_COMMAND and frame is not None and reply_ok(packet, frame) \
+            and packet[1] in positions:
+        line += "\n" + " " * 12 + format_status(positions[packet[1]], decode_status(frame))
+    return line
+
+
+def decode(exchanges, runs, speed, positions):
+    # Prints every exchange, spaced out as they happened divided by speed, or as fast as possible for 0. Each run in
+    # the capture starts with when it was captured, and is timed from its own start.
+    run = start = began = None
+    duration = 0
+    answered = 0
+    for exchange in exchanges:
+        if exchange.run != run:
+            if run is not None:
+                duration += last - start
+            run, start, began = exchange.run, exchange.sent, time.monotonic()
+            print(time.strftime("Captured %d-%m-%Y %T", time.localtime((runs[run] + start) / 1e9)))
+        last = exchange.sent
+        if speed:
+            delay = began + (exchange.sent - start) / 1e9 / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        frame, first_byte, complete = reply_frame(exchange)
+        answered += frame is not None and reply_ok(exchange.packet, frame)
+        print(describe_exchange(exchange, start, positions), flush=bool(speed))
+    if run is not None:
+        duration += last - start
+    print(f"{len(exchanges)} transactions over {duration / 1e9:.1f} s, {answered} answered")
+
+
+class ReplayBus(BusSimulator):
+    # A BusSimulator whose replies come from a capture rather than simulated nodes.
+    def __init__(self, exchanges, speed=1.0, baudrate=9600):
+        super(ReplayBus, self).__init__((), baudrate=baudrate)
+        self.speed = speed
+        self.recorded = defaultdict(list)
+        for exchange in exchanges:
+            self.recorded[bytes(exchange.packet)].append(exchange.replies)
+        self.played = defaultdict(int)
+
+    def answer(self, frame, arrived):
+        frame = bytes(frame)
+        recorded = self.recorded.get(frame)
+        if not recorded:
+            return
+        self.commands += 1
+        replies = recorded[self.played[frame] % len(recorded)]
+        self.played[frame] += 1
+        # The capture's times are from the start of the write, arrived is when the packet was all on the wire
+        written = arrived - len(frame) * self.byte_time
+        for offset, data in replies:
+            delay = written + offset / 1e9 / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self.master, data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays back an AGC capture file")
+    parser.add_argument("mode", choices=("decode", "serve"))
+    parser.add_argument("capture", help="file recorded with --capture or AGC_CAPTURE")
+    parser.add_argument("--speed", type=float,
+                        help="times faster than recorded, 0 for as fast as possible "
+                             "(default 0 for decode and 1 for serve)")
+    parser.add_argument("--positions", default=POSITIONS_CSV,
+                        help="antenna_positions.csv to number the positions by when decoding")
+    parser.add_argument("--link", help="also make this symlink to the pseudo terminal served on")
+    args = parser.parse_args()
+
+    exchanges, runs = load_exchanges(args.capture)
+    if args.mode == "decode":
+        try:
+            positions = {address: position for position, address in enumerate(load_addresses(args.positions))}
+        except OSError:
+            positions = {}
+        decode(exchanges, runs, args.speed or 0, positions)
+        return
+
+    speed = 1.0 if args.speed is None else args.speed
+    bus = ReplayBus(exchanges, speed if speed > 0 else float("inf"))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(bus.start(args.link), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.stop()
+        print(f"{bus.commands} packets played back from {len(exchanges)} recorded", flush=True)
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# AGC transaction scheduler for python
+# Requests for the bus wait in three priority classes, so an operator's command is never stuck behind a sweep:
+#   control     commands from an operator that change something, e.g. tripping a relay, always run next
+#   status      status and pings an operator asked for
+#   background  sweeps and logging
+# A control command waits at most for the transaction already on the bus and any control commands ahead of it.
+# A background request that has waited STARVATION_LIMIT seconds goes ahead of status requests, one at a time
+# between them, so a busy operator cannot stop the logging. Within a class requests run in the order they were
+# queued, taking turns between sources (the clients of a broker) when there is more than one.
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from agc_metrics import LatencyHistogram
+from agc_protocol import COMMANDS_BY_OPCODE
+
+CONTROL = 0
+STATUS = 1
+BACKGROUND = 2
+PRIORITY_NAMES = ("control", "status", "background")
+
+STARVATION_LIMIT = 5.0
+
+
+def interactive_priority(opcode):
+    # The class of a command an operator asked for: control when it changes something, otherwise status.
+    command = COMMANDS_BY_OPCODE.get(opcode)
+    return CONTROL if command is not None and command.effects else STATUS
+
+
+class TransactionQueue:
+    # Shared between the threads that queue requests and the one running them, so every access takes the lock.
+    def __init__(self, starvation_limit=STARVATION_LIMIT):
+        self.starvation_limit = starvation_limit
+        self.condition = threading.Condition()
+        # One per class, source: deque of (time queued, item) in the order the sources take turns
+        self.classes = [OrderedDict() for _ in PRIORITY_NAMES]
+        self.closed = False
+        self.depths = [0] * len(PRIORITY_NAMES)
+        self.max_depths = [0] * len(PRIORITY_NAMES)
+        self.waits = [LatencyHistogram() for _ in PRIORITY_NAMES]
+        self.promoted = 0
+        self.last_promoted = False
+
+    def put(self, item, priority, source=None):
+        with self.condition:
+            self.classes[priority].setdefault(source, deque()).append((time.monotonic(), item))
+            self.depths[priority] += 1
+            self.max_depths[priority] = max(self.max_depths[priority], self.depths[priority])
+            self.condition.notify()
+
+    def close(self):
+        # get() returns None once everything queued before this has been taken.
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def oldest(self, priority):
+        sources = self.classes[priority]
+        return min(waiting[0][0] for waiting in sources.values()) if sources else None
+
+    def take(self, priority):
+        # From the first source in turn, which then goes to the back.
+        sources = self.classes[priority]
+        source, waiting = next(iter(sources.items()))
+        queued, item = waiting.popleft()
+        if waiting:
+            sources.move_to_end(source)
+        else:
+            del sources[source]
+        self.depths[priority] -= 1
+        self.waits[priority].record(time.monotonic() - queued)
+        return item, priority
+
+    def choose(self):
+        # The next (item, priority) to run, None when nothing is queued. The lock must be held.
+        if self.classes[CONTROL]:
+            return self.take(CONTROL)
+        background = self.oldest(BACKGROUND)
+        if background is not None and time.monotonic() - background >= self.starvation_limit \
+                and self.classes[STATUS] and not self.last_promoted:
+            self.promoted += 1
+            self.last_promoted = True
+            return self.take(BACKGROUND)
+        self.last_promoted = False
+        for priority in (STATUS, BACKGROUND):
+            if self.classes[priority]:
+                return self.take(priority)
+        return None
+
+    def get(self):
+        # The next (item, priority) to run, waiting for one if need be.
+        with self.condition:
+            while True:
+                taken = self.choose()
+                if taken is not None or self.closed:
+                    return taken
+                self.condition.wait()
+
+    def poll(self):
+        # get() without waiting, None when nothing is queued. For a caller with its own way to wait, asyncio.
+        with self.condition:
+            return self.choose()
+
+    def take_matching(self, priority, source, match):
+        # Takes the next request of every other source in the class for which match(item) is true.
+        with self.condition:
+            taken = []
+            sources = self.classes[priority]
+            for other, waiting in list(sources.items()):
+                if other is not source and match(waiting[0][1]):
+                    taken.append(self.take_from(priority, other))
+            return taken
+
+    def take_from(self, priority, source):
+        sources = self.classes[priority]
+        queued, item = sources[source].popleft()
+        if not sources[source]:
+            del sources[source]
+        self.depths[priority] -= 1
+        self.waits[priority].record(time.monotonic() - queued)
+        return item
+
+    def discard(self, source):
+        # Drops everything still queued from a source, e.g. a client that has gone.
+        with self.condition:
+            for priority, sources in enumerate(self.classes):
+                self.depths[priority] -= len(sources.pop(source, ()))
+
+    def summary(self):
+        # {class name: {"depth", "max_depth", "wait": histogram summary}, "promoted": background requests that
+        # went ahead of status ones}
+        with self.condition:
+            summary = {name: {"depth": self.depths[priority], "max_depth": self.max_depths[priority],
+                              "wait": self.waits[priority].summary()}
+                       for priority, name in enumerate(PRIORITY_NAMES)}
+            summary["promoted"] = self.promoted
+            return summary
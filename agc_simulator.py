@@ -0,0 +1,213 @@
+# Simulated AGC bus for python
+# Emulates every AGC microcontroller in antenna_positions.csv behind a pseudo terminal, so the commander,
+# the headless tools and the benchmarks can be run and regression tested without the radar.
+#
+#   python agc_simulator.py --link /tmp/agc_bus --latency 5 --jitter 2
+#   python agc_commander.py ... with /tmp/agc_bus as the serial port
+#
+# Each node keeps its own relay, AGC loop, capacitor and auto reset state and answers every command like
+# the real micro. Its reply latency, jitter, dropped replies and corrupted bytes can be set per node.
+# Bytes go out one character time apart (10 bits at 9600 baud), and a reply never starts before the command
+# would have finished arriving on the wire, so timings match the real bus.
+
+import argparse
+import json
+import os
+import pty
+import random
+import select
+import signal
+import sys
+import threading
+import time
+import tty
+from collections import namedtuple
+
+from agc_positions import POSITIONS_CSV, load_addresses
+from agc_protocol import BITS_PER_BYTE, COMMANDS_BY_OPCODE, STATUS_COMMAND, STX, FrameParser, block_checksum
+
+BAUDRATE = 9600
+
+# latency and jitter in seconds, the reply starts latency +/- jitter after the command has arrived.
+# drop and corrupt are probabilities per reply, a corrupt reply has one bit flipped.
+NodeConfig = namedtuple("NodeConfig", ["latency", "jitter", "drop", "corrupt"])
+DEFAULT_NODE = NodeConfig(latency=0.005, jitter=0.001, drop=0.0, corrupt=0.0)
+
+# Readings of a healthy transmitter, rail codes of 128 are the nominal voltages
+HEALTHY_READINGS = {"five": 128, "fifteen": 128, "five_hundred": 128, "minus_fifteen": 128, "fifty": 128,
+                    "temp": 0x28, "forward": 0x64, "reflected": 0x14, "port_c": 0xff}
+
+
+class SimulatedAGC:
+    def __init__(self, address, config=DEFAULT_NODE, readings=None):
+        self.address = address
+        self.config = config
+        self.readings = dict(HEALTHY_READINGS, **(readings or {}))
+        self.reset()
+
+    def reset(self):
+        # The state a micro comes up in, as the commander assumes after a reset
+        self.relay_closed = True
+        self.agc_loop_closed = True
+        self.cap1_fitted = True
+        self.cap2_fitted = False
+        self.auto_reset_enabled = False
+        self.inhibit_on = False
+        # Whether the transmitter's power is on. No command changes it, so a simulated transmitter is always powered
+        self.power_active = True
+
+    def port_a(self):
+        return self.relay_closed | self.inhibit_on << 1 | self.power_active << 2
+
+    def port_b(self):
+        return self.cap1_fitted << 2 | self.cap2_fitted << 3 | self.agc_loop_closed << 4
+
+    def status_frame(self):
+        readings = self.readings
+        body = bytes([self.address, 12, STATUS_COMMAND, readings["five"], readings["fifteen"],
+                      readings["five_hundred"], readings["minus_fifteen"], readings["fifty"], readings["temp"],
+                      readings["forward"], readings["reflected"], self.port_a(), self.port_b(), readings["port_c"]])
+        return bytes([STX]) + body + bytes([block_checksum(body)])
+
+    def handle(self, opcode):
+        # Carries out the command and returns the reply it sends.
+        if opcode not in COMMANDS_BY_OPCODE:
+            return None
+        if opcode == STATUS_COMMAND:
+            return self.status_frame()
+        if opcode == 0x0a:
+            self.reset()
+        for name, value in COMMANDS_BY_OPCODE[opcode].effects:
+            setattr(self, name, value)
+        return bytes([STX, self.address])
+
+
+class BusSimulator:
+    def __init__(self, addresses, default=DEFAULT_NODE, nodes=None, readings=None, baudrate=BAUDRATE, seed=None):
+        # nodes maps an address to its own NodeConfig, readings maps an address to reading overrides.
+        nodes = nodes or {}
+        readings = readings or {}
+        self.nodes = {address: SimulatedAGC(address, nodes.get(address, default), readings.get(address))
+                      for address in addresses}
+        self.byte_time = BITS_PER_BYTE / baudrate
+        self.random = random.Random(seed)
+        self.master = self.slave = None
+        self.port = None
+        self.running = False
+        self.thread = None
+        self.commands = 0
+
+    def start(self, link=None):
+        # Opens the pseudo terminal and returns the device name to use as the serial port.
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        if link:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(self.port, link)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="agc simulator", daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        parser = FrameParser()
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            data = os.read(self.master, 256)
+            # The host wrote its packet all at once, on the wire it takes a character time per byte
+            arrived = time.monotonic() + len(data) * self.byte_time
+            frame = parser.feed(data)
+            while frame is not None:
+                self.answer(frame, arrived)
+                frame = parser.feed(b"")
+
+    def answer(self, frame, arrived):
+        node = self.nodes.get(frame[1])
+        if node is None or len(frame) < 4:
+            return
+        self.commands += 1
+        reply = node.handle(frame[3])
+        config = node.config
+        if reply is None or self.random.random() < config.drop:
+            return
+        if self.random.random() < config.corrupt:
+            reply = bytearray(reply)
+            reply[self.random.randrange(len(reply))] ^= 1 << self.random.randrange(8)
+        start = arrived + max(0.0, config.latency + self.random.uniform(-config.jitter, config.jitter))
+        for index in range(len(reply)):
+            delay = start + index * self.byte_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self.master, reply[index:index + 1])
+
+
+def node_config(settings, base=DEFAULT_NODE):
+    # Latency and jitter are given in milliseconds.
+    return NodeConfig(latency=settings.get("latency", base.latency * 1000) / 1000,
+                      jitter=settings.get("jitter", base.jitter * 1000) / 1000,
+                      drop=settings.get("drop", base.drop),
+                      corrupt=settings.get("corrupt", base.corrupt))
+
+
+def load_config(path, addresses, default):
+    # {"nodes": {"7": {"latency": 40, "jitter": 10, "drop": 0.1, "corrupt": 0.01, "port_c": 253}}}
+    # Nodes are given by antenna position, counting from 1. Anything that is not a timing is a reading.
+    with open(path) as config_file:
+        config = json.load(config_file)
+    nodes = {}
+    readings = {}
+    for position, settings in config.get("nodes", {}).items():
+        address = addresses[int(position) - 1]
+        nodes[address] = node_config(settings, default)
+        readings[address] = {name: value for name, value in settings.items() if name not in NodeConfig._fields}
+    return nodes, readings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated AGC bus on a pseudo terminal")
+    parser.add_argument("--positions", default=POSITIONS_CSV, help="antenna_positions.csv")
+    parser.add_argument("--latency", type=float, default=DEFAULT_NODE.latency * 1000, help="reply latency in ms")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_NODE.jitter * 1000, help="latency jitter in ms")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability a reply is dropped")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="probability a reply has a flipped bit")
+    parser.add_argument("--dead", type=int, action="append", default=[], help="position that never answers")
+    parser.add_argument("--config", help="JSON file of per position settings")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE)
+    parser.add_argument("--link", help="also make this symlink to the pseudo terminal")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    addresses = load_addresses(args.positions)
+    default = node_config({"latency": args.latency, "jitter": args.jitter, "drop": args.drop,
+                           "corrupt": args.corrupt})
+    nodes, readings = load_config(args.config, addresses, default) if args.config else ({}, {})
+    for position in args.dead:
+        nodes[addresses[position - 1]] = default._replace(drop=1.0)
+    simulator = BusSimulator(addresses, default, nodes, readings, args.baudrate, args.seed)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(simulator.start(args.link), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+
+if __name__ == "__main__":
+    main()
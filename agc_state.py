@@ -0,0 +1,131 @@
+# AGC last known state for python
+# The latest status reply and command results of every position, with when each came in, so the window can show a
+# position the moment it is picked instead of after a round trip. Anything older than STALE_AFTER seconds is shown
+# with its age and read again in the background. The state is saved to a JSON file when the window closes and
+# loaded when it opens, so it opens already filled in.
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from agc_protocol import COMMANDS_BY_OPCODE, STATUS_COMMAND, decode_status, reply_ok
+from agc_timeouts import STATE_DIRECTORY
+
+STATE_FILE = os.path.join(STATE_DIRECTORY, "last_state.json")
+STALE_AFTER = 60.0
+
+# status is the decoded reply and frame the bytes it came from, time is time.time() when it arrived.
+CachedStatus = namedtuple("CachedStatus", ["status", "frame", "time"])
+# Whether the reply to a command was good, and when it came in.
+CachedResult = namedtuple("CachedResult", ["ok", "time"])
+
+
+def describe_age(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    if seconds < 2 * 86400:
+        return f"{seconds / 3600:.0f} h"
+    return f"{seconds / 86400:.0f} days"
+
+
+class StateCache:
+    # Filled in from the bus threads and read from the GUI thread, so every access takes the lock.
+    def __init__(self, addresses, ttl=STALE_AFTER, path=None):
+        # addresses is the AGC address of each position, a saved position is only loaded back if it still matches.
+        self.addresses = tuple(addresses)
+        self.ttl = ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.statuses = {}      # position: CachedStatus
+        self.results = {}       # position: {command name: CachedResult}
+        self.listeners = []
+        if path:
+            self.load(path)
+
+    def add_listener(self, listener):
+        # listener(position) after every reply recorded for the position, on the thread of its bus.
+        self.listeners.append(listener)
+
+    def record(self, position, reply, now=None):
+        # Called with the reply to every command sent to position. Empty packets are ignored.
+        if not reply.packet:
+            return
+        now = time.time() if now is None else now
+        opcode = reply.packet[3]
+        command = COMMANDS_BY_OPCODE.get(opcode)
+        ok = reply_ok(reply.packet, reply.data)
+        with self.lock:
+            self.results.setdefault(position, {})[command.name if command else f"{opcode:02x}"] = CachedResult(ok, now)
+            if ok and opcode == STATUS_COMMAND:
+                self.statuses[position] = CachedStatus(decode_status(reply.data), bytes(reply.data), now)
+        for listener in self.listeners:
+            listener(position)
+
+    def status(self, position):
+        with self.lock:
+            return self.statuses.get(position)
+
+    def result(self, position, name):
+        # The CachedResult of the last name command sent to position, None if there has not been one.
+        with self.lock:
+            return self.results.get(position, {}).get(name)
+
+    def results_since(self, position, since):
+        # (name, CachedResult) of the commands answered after since, oldest first.
+        with self.lock:
+            results = self.results.get(position, {})
+            return sorted(((name, result) for name, result in results.items() if result.time > since),
+                          key=lambda item: item[1].time)
+
+    def age(self, position, now=None):
+        # Seconds since the last status of position, None when there has not been one.
+        cached = self.status(position)
+        if cached is None:
+            return None
+        return max(0.0, (time.time() if now is None else now) - cached.time)
+
+    def stale(self, position, now=None):
+        age = self.age(position, now)
+        return age is None or age > self.ttl
+
+    def load(self, path):
+        # A missing or unreadable file just means starting from nothing.
+        try:
+            with open(path) as state_file:
+                document = json.load(state_file)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            for key, saved in document.get("positions", {}).items():
+                position = int(key)
+                if position >= len(self.addresses) or int(saved["address"], 16) != self.addresses[position]:
+                    continue
+                if saved.get("frame"):
+                    frame = bytes.fromhex(saved["frame"])
+                    self.statuses[position] = CachedStatus(decode_status(frame), frame, saved["time"])
+                self.results[position] = {name: CachedResult(*result) for name, result in saved["results"].items()}
+
+    def save(self, path=None):
+        # Written to a temporary file and renamed, so a crash part way never leaves half a file.
+        path = path or self.path
+        if not path:
+            return
+        with self.lock:
+            positions = {}
+            for position, address in enumerate(self.addresses):
+                cached = self.statuses.get(position)
+                results = self.results.get(position)
+                if cached is None and not results:
+                    continue
+                positions[str(position)] = {"address": f"{address:02x}",
+                                            "frame": cached.frame.hex() if cached else None,
+                                            "time": cached.time if cached else None,
+                                            "results": {name: list(result) for name, result in (results or {}).items()}}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "w") as state_file:
+            json.dump({"positions": positions}, state_file, indent=1)
+        os.replace(path + ".tmp", path)
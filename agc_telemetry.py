@@ -0,0 +1,107 @@
+# AGC telemetry store for python
+# Keeps the status replies from every position in a fixed size ring buffer file, one file per position.
+# The files are memory mapped, so adding a record is a copy into the mapping with no system call, and any
+# number of readers can map the same file while the logger is writing to it.
+
+# File layout
+# Header, 32 bytes: magic, capacity (records), head (total records ever written), spare.
+# Then capacity records of 32 bytes: time (ns since the epoch), responded, the raw status frame, spare.
+# Record n lives in slot n % capacity. The writer fills the slot before moving head on, so a reader
+# that reads head first only ever sees complete records.
+
+import mmap
+import os
+import time
+
+import numpy as np
+
+from agc_decode import decode_status_batch
+from agc_protocol import STATUS_LENGTH
+
+MAGIC = b"AGCRING1"
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("capacity", "<u8"), ("head", "<u8"), ("spare", "u1", (8,))])
+RECORD_DTYPE = np.dtype([("time", "<i8"), ("responded", "u1"), ("frame", "u1", (STATUS_LENGTH,)),
+                         ("spare", "u1", (7,))])
+# A week of polling once a minute.
+DEFAULT_CAPACITY = 7 * 24 * 60
+
+
+def capacity_for(retention, interval):
+    # Records needed to keep retention seconds of polls made every interval seconds.
+    return int(-(-retention // interval))
+
+
+class TelemetryRing:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, writable=True):
+        # A new file is created with the given capacity, an existing file keeps the capacity it was made with.
+        self.path = path
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            with open(path, "wb") as new_file:
+                header = np.zeros(1, dtype=HEADER_DTYPE)
+                header["magic"] = MAGIC
+                header["capacity"] = capacity
+                new_file.write(header.tobytes())
+                new_file.truncate(HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize)
+        with open(path, "r+b" if writable else "rb") as ring_file:
+            self.map = mmap.mmap(ring_file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.header = np.ndarray(1, dtype=HEADER_DTYPE, buffer=self.map)[0]
+        if self.header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not an AGC telemetry file")
+        self.capacity = int(self.header["capacity"])
+        self.records = np.ndarray(self.capacity, dtype=RECORD_DTYPE, buffer=self.map, offset=HEADER_DTYPE.itemsize)
+
+    def append(self, frame, timestamp=None):
+        # frame is the status reply, or None when the position did not answer.
+        head = int(self.header["head"])
+        record = self.records[head % self.capacity]
+        record["time"] = time.time_ns() if timestamp is None else timestamp
+        record["responded"] = frame is not None
+        if frame is not None:
+            record["frame"] = np.frombuffer(frame[:STATUS_LENGTH], dtype=np.uint8)
+        else:
+            record["frame"] = 0
+        self.header["head"] = head + 1
+
+    def read(self, count=None):
+        # Copies out the newest count records (all of them by default), oldest first.
+        head = int(self.header["head"])
+        # When the ring is full the oldest slot is the next one the writer will use, so leave it out.
+        available = min(head, self.capacity - 1)
+        count = available if count is None else min(count, available)
+        slots = np.arange(head - count, head) % self.capacity
+        return self.records[slots]
+
+    def decoded(self, count=None):
+        # The newest records as (time, responded, decoded status), see agc_decode.STATUS_DTYPE.
+        records = self.read(count)
+        return records["time"], records["responded"].astype(bool), decode_status_batch(records["frame"])
+
+    def close(self):
+        del self.header, self.records
+        self.map.close()
+
+
+class TelemetryStore:
+    # One ring per position in a directory, positions count from 0 like the packet table.
+    def __init__(self, directory, capacity=DEFAULT_CAPACITY, writable=True):
+        self.directory = directory
+        self.capacity = capacity
+        self.writable = writable
+        self.rings = {}
+        if writable:
+            os.makedirs(directory, exist_ok=True)
+
+    def ring(self, position):
+        if position not in self.rings:
+            path = os.path.join(self.directory, f"agc_{position:02d}.ring")
+            self.rings[position] = TelemetryRing(path, self.capacity, self.writable)
+        return self.rings[position]
+
+    def append(self, position, frame, timestamp=None):
+        self.ring(position).append(frame, timestamp)
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
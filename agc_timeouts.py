@@ -0,0 +1,136 @@
+# Adaptive reply timeouts for the AGC bus
+# Rather than one serial timeout for everything, the time each AGC address takes to start answering each command
+# is learned, and the wait for a reply is set from that: a high percentile of what has been seen, with a safety
+# margin, kept between a minimum and a maximum. A node that has gone quiet then costs tens of milliseconds
+# instead of the maximum, while one that is always slow is given the time it needs. The profile is saved to a
+# JSON file so it is not relearned after every restart.
+
+import json
+import os
+import threading
+
+from agc_metrics import SUB_BUCKETS, LatencyHistogram, bucket_index, bucket_lowest
+
+STATE_DIRECTORY = os.path.join(os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+                               "agc_commander")
+
+MINIMUM = 0.02
+MAXIMUM = 1.0
+PERCENTILE = 0.99
+FACTOR = 1.5
+MARGIN = 0.01
+# Replies needed from an address before its times are trusted on their own. Until then, and for an address that
+# has never answered, the middle of the waits learned for the other addresses is used (or what the address has
+# shown so far, if that is longer), or the maximum when nothing has been learned yet.
+MIN_SAMPLES = 5
+# Counts are halved once this many replies have been seen, so the profile follows a node that slows down.
+WINDOW = 1000
+# The first reply missed from a node that has answered before is followed by a wait of the full maximum, so one
+# that has become slower than anything learned so far is heard and learned from rather than marked dead. Each miss
+# after that doubles its usual wait, up to this many times, so a dead one costs little more once it has been tried.
+MAX_WIDENING = 2
+
+
+def profile_file(port, directory=STATE_DIRECTORY):
+    # One profile per serial port, since the same addresses can be in use on another radar's bus.
+    return os.path.join(directory, f"reply_timeouts_{os.path.basename(port)}.json")
+
+
+def halve(histogram):
+    histogram.counts = {index: count // 2 for index, count in histogram.counts.items() if count > 1}
+    histogram.total = sum(histogram.counts.values())
+
+
+class TimeoutProfile:
+    # Used from the bus worker and saved from anywhere, so every access takes the lock.
+    def __init__(self, path=None, minimum=MINIMUM, maximum=MAXIMUM):
+        self.path = path
+        self.minimum = minimum
+        self.maximum = maximum
+        self.lock = threading.Lock()
+        self.histograms = {}    # (opcode, address): response times
+        self.misses = {}        # (opcode, address): replies missed in a row
+        if path:
+            self.load(path)
+
+    def deadline(self, histogram):
+        return min(self.maximum, max(self.minimum, histogram.percentile(PERCENTILE) * FACTOR + MARGIN))
+
+    def timeout(self, opcode, address, probe=False):
+        # Seconds to wait for the first byte of the reply. The probe of a node whose circuit breaker is open (see
+        # agc_health.py) is given the full maximum, so a node that has always been slower than the others is heard
+        # in the end. Everything else sent to it gets the usual wait.
+        key = (opcode, address)
+        with self.lock:
+            misses = self.misses.get(key, 0)
+            if probe:
+                return self.maximum
+            histogram = self.histograms.get(key)
+            if misses == 1 and histogram is not None and histogram.total:
+                return self.maximum
+            if histogram is not None and histogram.total >= MIN_SAMPLES:
+                wait = self.deadline(histogram)
+            else:
+                deadlines = sorted(self.deadline(histogram) for (known, _), histogram in self.histograms.items()
+                                   if known == opcode and histogram.total >= MIN_SAMPLES)
+                if not deadlines:
+                    return self.maximum
+                wait = deadlines[len(deadlines) // 2]
+                if histogram is None or not histogram.total:
+                    # Never heard from, so most likely not there at all, the probes will find it if it is slow
+                    return wait
+                wait = max(wait, self.deadline(histogram))
+            return min(self.maximum, wait * 2 ** min(misses, MAX_WIDENING))
+
+    def record(self, opcode, address, response):
+        # response is the seconds from the end of the write to the first reply byte, None when nothing came.
+        key = (opcode, address)
+        with self.lock:
+            if response is None:
+                self.misses[key] = self.misses.get(key, 0) + 1
+                return
+            self.misses[key] = 0
+            histogram = self.histograms.setdefault(key, LatencyHistogram())
+            histogram.record(response)
+            if histogram.total >= WINDOW:
+                halve(histogram)
+
+    def load(self, path):
+        # A missing, unreadable or out of date file just means starting from nothing.
+        try:
+            with open(path) as profile_file:
+                document = json.load(profile_file)
+        except (OSError, ValueError):
+            return
+        if document.get("sub_buckets") != SUB_BUCKETS:
+            return
+        with self.lock:
+            for opcode, addresses in document["opcodes"].items():
+                for address, buckets in addresses.items():
+                    key = (int(opcode, 16), int(address, 16))
+                    histogram = self.histograms.setdefault(key, LatencyHistogram())
+                    for microseconds, count in buckets:
+                        index = bucket_index(microseconds)
+                        histogram.counts[index] = histogram.counts.get(index, 0) + count
+                        histogram.total += count
+                        if histogram.lowest is None or microseconds < histogram.lowest:
+                            histogram.lowest = microseconds
+                        if histogram.highest is None or microseconds > histogram.highest:
+                            histogram.highest = microseconds
+
+    def save(self, path=None):
+        # Written to a temporary file and renamed, so a crash part way never leaves half a profile.
+        path = path or self.path
+        if not path:
+            return
+        with self.lock:
+            opcodes = {}
+            for (opcode, address), histogram in sorted(self.histograms.items()):
+                # Kept as the lowest value of each bucket, which maps back to the same bucket when loaded
+                opcodes.setdefault(f"{opcode:02x}", {})[f"{address:02x}"] = [
+                    [bucket_lowest(index), count] for index, count in sorted(histogram.counts.items())]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "w") as profile_file:
+            json.dump({"sub_buckets": SUB_BUCKETS, "minimum": self.minimum, "maximum": self.maximum,
+                       "opcodes": opcodes}, profile_file, indent=1)
+        os.replace(path + ".tmp", path)
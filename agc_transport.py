@@ -0,0 +1,117 @@
+# AGC serial transports for python
+# The bus code talks to the serial port through the part of pyserial's Serial it needs: write(), flush(), read(size)
+# bounded by the timeout attribute, reset_input_buffer(), fileno(), nonblocking(), close() and baudrate. Two
+# transports provide it:
+#   pyserial  pyserial itself, as always
+#   termios   the tty opened and set up directly with termios, waiting in epoll. VMIN is set to the bytes still
+#             missing from the frame, so the kernel wakes the reader once when they have all arrived, rather than
+#             for every byte as pyserial's read loop does.
+# AGC_TRANSPORT in the environment picks the transport, pyserial when it is not set.
+
+import os
+import select
+import termios
+import time
+
+import serial
+
+from agc_capture import CapturedPort
+
+TRANSPORTS = ("pyserial", "termios")
+TRANSPORT = os.environ.get("AGC_TRANSPORT", "pyserial")
+# VMIN is a single byte
+MAX_VMIN = 255
+
+
+class TermiosPort:
+    def __init__(self, port, baudrate=9600, timeout=1):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        speed = getattr(termios, f"B{baudrate}", None)
+        if speed is None:
+            raise ValueError(f"unsupported baud rate {baudrate}")
+        self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            # Raw 8N1 with no flow control or line editing, as pyserial sets it up
+            self.attributes = [0, 0, termios.CS8 | termios.CREAD | termios.CLOCAL, 0, speed, speed,
+                               termios.tcgetattr(self.fd)[6]]
+            self.attributes[6][termios.VMIN] = 1
+            self.attributes[6][termios.VTIME] = 0
+            termios.tcsetattr(self.fd, termios.TCSANOW, self.attributes)
+            termios.tcflush(self.fd, termios.TCIOFLUSH)
+        except (OSError, termios.error):
+            os.close(self.fd)
+            raise
+        self.vmin = 1
+        self.poller = select.epoll()
+        self.poller.register(self.fd, select.EPOLLIN)
+
+    def set_vmin(self, count):
+        # Reading stays non-blocking, VMIN only decides when epoll reports the port readable.
+        count = max(1, min(count, MAX_VMIN))
+        if count != self.vmin:
+            self.attributes[6][termios.VMIN] = count
+            termios.tcsetattr(self.fd, termios.TCSANOW, self.attributes)
+            self.vmin = count
+
+    def read(self, size=1):
+        # Up to size bytes, returning once they have all arrived or the timeout is up, as pyserial does.
+        received = bytearray()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(received) < size:
+            self.set_vmin(size - len(received))
+            remaining = -1 if deadline is None else max(0.0, deadline - time.monotonic())
+            ready = self.poller.poll(remaining)
+            # Whatever has come in is taken, even when the time is up
+            try:
+                chunk = os.read(self.fd, size - len(received))
+            except BlockingIOError:
+                chunk = None
+            if chunk == b"":
+                raise OSError(f"{self.port} has closed")
+            received += chunk or b""
+            if not ready or (deadline is not None and time.monotonic() >= deadline):
+                break
+        return bytes(received)
+
+    def write(self, data):
+        data = bytes(data)
+        unsent = memoryview(data)
+        while unsent:
+            try:
+                unsent = unsent[os.write(self.fd, unsent):]
+            except BlockingIOError:
+                select.select([], [self.fd], [])
+        return len(data)
+
+    def flush(self):
+        # Returns once everything written has left the port, as pyserial's flush does.
+        termios.tcdrain(self.fd)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def fileno(self):
+        return self.fd
+
+    def nonblocking(self):
+        pass    # Always is
+
+    def close(self):
+        self.poller.close()
+        os.close(self.fd)
+
+
+def open_port(port, baudrate=9600, timeout=1, transport=TRANSPORT, capture=None):
+    # The serial port as 8N1 at baudrate through the named transport, with its traffic recorded to capture (an
+    # agc_capture.Capture) when one is given.
+    if transport == "termios":
+        opened = TermiosPort(port, baudrate, timeout)
+    elif transport == "pyserial":
+        opened = serial.Serial(port, baudrate=baudrate, bytesize=8, parity='N', stopbits=1, timeout=timeout)
+    else:
+        raise ValueError(f"unknown transport {transport}")
+    if capture is None:
+        return opened
+    return CapturedPort(opened, capture.channel(port))
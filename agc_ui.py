@@ -0,0 +1,56 @@
+# Compiled window layout for the AGC commander
+# agc_commander_ui.ui is compiled to python once and the result is cached, named after a hash of the .ui
+# file, so start up imports ready made code instead of parsing the XML and generating it every time.
+# The cache is only rebuilt when the .ui file changes. Running this file builds it ahead of time.
+
+import importlib.util
+import os
+import tempfile
+import zlib
+
+UI_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agc_commander_ui.ui")
+CACHE_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "agc_commander")
+
+
+def cached_module_path(ui_file=UI_FILE):
+    # crc32 and length are plenty to notice an edit, and zlib is much lighter to import than hashlib
+    with open(ui_file, "rb") as ui:
+        contents = ui.read()
+    return os.path.join(CACHE_DIRECTORY, f"agc_commander_ui_{zlib.crc32(contents):08x}_{len(contents)}.py")
+
+
+def build(ui_file=UI_FILE):
+    # Compiles the .ui file if it has changed and returns the path of the module.
+    path = cached_module_path(ui_file)
+    if os.path.exists(path):
+        return path
+    # uic is only needed here, so it is only imported when the cache is rebuilt
+    from PyQt5 import uic
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    for old in os.listdir(CACHE_DIRECTORY):
+        if old.startswith("agc_commander_ui_") and old.endswith(".py"):
+            os.remove(os.path.join(CACHE_DIRECTORY, old))
+    # Written to a temporary file first so a second commander starting at the same time never imports half a module
+    handle, temporary = tempfile.mkstemp(suffix=".py", dir=CACHE_DIRECTORY)
+    with os.fdopen(handle, "w") as module:
+        uic.compileUi(ui_file, module, from_imports=False)
+    os.replace(temporary, path)
+    return path
+
+
+def load_ui_class(ui_file=UI_FILE):
+    # The generated Ui_ class, its setupUi(window) makes every widget an attribute of the window.
+    try:
+        path = build(ui_file)
+    except OSError:
+        # Nowhere to keep the cache, so compile it in memory as every start up used to
+        from PyQt5 import uic
+        return uic.loadUiType(ui_file)[0]
+    spec = importlib.util.spec_from_file_location("agc_commander_ui", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Ui_AGC_COMMANDER
+
+
+if __name__ == "__main__":
+    print(build())
@@ -0,0 +1,62 @@
+# AGC status view model
+# What the commander window shows, kept as {widget name: value} with a str for a label and a bool for a check box.
+# New values are compared with what is already on screen and only the ones that differ are set, all together at
+# most once every REFRESH_INTERVAL, so polling faster than anyone can read costs no redrawing.
+
+import time
+
+from PyQt5.QtCore import QTimer
+
+from agc_protocol import FLAGS
+
+# Milliseconds between updates of the window, several changes in between are applied as one.
+REFRESH_INTERVAL = 100
+
+
+def status_view(status):
+    # The widget values for a decoded status reply.
+    view = {"temp_value": f"{status.temp:02x}", "f_power_value": f"{status.forward:02x}",
+            "r_power_value": f"{status.reflected:02x}", "five_value": str(status.five),
+            "fifteen_value": str(status.fifteen), "fifty_value": str(status.fifty),
+            "minus_fifteen_value": str(status.minus_fifteen), "five_hundred_value": str(status.five_hundred),
+            "port_A": f"{status.port_a:08b}", "port_B": f"{status.port_b:08b}", "port_C": f"{status.port_c:08b}"}
+    for name, offset, bit, inverted in FLAGS:
+        view[name] = getattr(status, name)
+    return view
+
+
+class ViewModel:
+    def __init__(self, widgets, interval=REFRESH_INTERVAL):
+        # widgets is the object the widgets are attributes of, the window.
+        self.widgets = widgets
+        self.interval = interval
+        self.shown = {}
+        self.pending = {}
+        self.last_applied = 0.0
+        self.applied = 0
+        self.skipped = 0
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.apply)
+
+    def update(self, values):
+        # Queues {widget name: value}, a later value for the same widget replaces an earlier one.
+        self.pending.update(values)
+        if not self.timer.isActive():
+            wait = self.last_applied + self.interval / 1000 - time.monotonic()
+            self.timer.start(max(0, int(wait * 1000)))
+
+    def apply(self):
+        pending, self.pending = self.pending, {}
+        for name, value in pending.items():
+            if self.shown.get(name) == value:
+                self.skipped += 1
+                continue
+            widget = getattr(self.widgets, name)
+            if isinstance(value, bool):
+                widget.setChecked(value)
+            else:
+                widget.setText(value)
+            self.shown[name] = value
+            self.applied += 1
+        self.last_applied = time.monotonic()
@@ -0,0 +1,294 @@
+# Bus benchmark for the AGC commander
+# Measures the command path end to end against a serial port: round trip latency per command (p50/p95/p99),
+# the wall time of a full status sweep like logging_stuff, the bytes per second that achieves against what
+# 9600 baud allows, how long a ping waits while a background sweep is queued, the same round trips and many queued
+# at once through the asyncio client against the bus worker, and how fast status replies are decoded. Run from
+# anywhere:
+#   python benchmarks/bus.py                         # against the simulated bus
+#   python benchmarks/bus.py --buses 2               # the positions split over 2 simulated buses
+#   python benchmarks/bus.py --port /dev/ttyS0       # against the real one, only status and ping are sent unless
+#                                                    # --allow-control is given
+#   python benchmarks/bus.py --transport termios     # the serial ports driven through termios and epoll
+#   python benchmarks/bus.py --output new.json --compare old.json
+# With --compare the exit status is 1 if anything got slower by more than --tolerance.
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agc_async import AGCClient
+from agc_broker import BrokerClient, is_broker
+from agc_decode import decode_status_batch
+from agc_fleet import BusGroup, Fleet
+from agc_positions import POSITIONS_CSV, load_addresses
+from agc_protocol import COMMANDS_BY_NAME, STATUS_COMMAND, decode_status, reply_ok
+from agc_scheduler import BACKGROUND, STATUS
+from agc_simulator import BITS_PER_BYTE, DEFAULT_NODE, BusSimulator
+from agc_transport import TRANSPORT, TRANSPORTS
+
+BAUDRATE = 9600
+# The only commands sent to a real bus unless --allow-control is given, neither changes anything on the transmitter
+READ_ONLY = ("status", "ping")
+# Results where a bigger number is better, everything else is a time
+HIGHER_IS_BETTER = ("bytes_per_second", "bus_efficiency", "frames_per_second")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarise(times):
+    return {"p50": percentile(times, 0.50), "p95": percentile(times, 0.95), "p99": percentile(times, 0.99),
+            "mean": sum(times) / len(times), "count": len(times)}
+
+
+def thread_cpu(bus):
+    # CPU seconds used by the thread of a bus worker so far, read with time.thread_time() on that thread by a
+    # request with nothing to send. None for a broker, whose bus thread is in another process.
+    if isinstance(bus, BrokerClient):
+        return None
+    used = queue.Queue(maxsize=1)
+    bus.submit(b"", lambda reply: used.put(time.thread_time()), expect_reply=False)
+    return used.get()
+
+
+def round_trips(fleet, name, count):
+    # Times count commands spread over every position, failures are counted rather than timed.
+    opcode = COMMANDS_BY_NAME[name].opcode
+    times = []
+    failures = 0
+    for index in range(count):
+        position = index % len(fleet.packets)
+        started = time.perf_counter()
+        reply = fleet.call(position, fleet.packets[position][opcode])
+        elapsed = time.perf_counter() - started
+        if reply_ok(reply.packet, reply.data):
+            times.append(elapsed)
+        else:
+            failures += 1
+    result = summarise(times) if times else {}
+    result["failures"] = failures
+    return result
+
+
+def sweeps(fleet, count):
+    # Status of every position, with every bus working at once.
+    times = []
+    transferred = 0
+    for _ in range(count):
+        started = time.perf_counter()
+        for reply in fleet.call_all(STATUS_COMMAND):
+            transferred += len(reply.packet) + len(reply.data)
+        times.append(time.perf_counter() - started)
+    bytes_per_second = transferred / sum(times)
+    result = summarise(times)
+    result["bytes_per_second"] = bytes_per_second
+    result["bus_efficiency"] = bytes_per_second / (len(fleet.buses) * BAUDRATE / BITS_PER_BYTE)
+    return result
+
+
+def during_sweeps(fleet, count):
+    # Round trips of pings asked for while background sweeps of every position are queued, which they should
+    # hardly notice, see agc_scheduler.py.
+    opcode = COMMANDS_BY_NAME["ping"].opcode
+    swept = threading.Event()
+    fleet.batch(STATUS_COMMAND, range(len(fleet.packets)), lambda results: None, 0, BACKGROUND)
+    fleet.batch(STATUS_COMMAND, range(len(fleet.packets)), lambda results: swept.set(), 0, BACKGROUND)
+    times = []
+    for index in range(count):
+        position = index % len(fleet.packets)
+        started = time.perf_counter()
+        fleet.call(position, fleet.packets[position][opcode], priority=STATUS)
+        times.append(time.perf_counter() - started)
+    swept.wait()
+    return summarise(times)
+
+
+def queued(fleet, count):
+    # count status requests queued at once on the first bus, timed until the last reply, with the CPU they took
+    # (the simulated buses run in this process too, so that is counted as well).
+    done = threading.Semaphore(0)
+    positions = [position for position in range(len(fleet.packets)) if fleet.bus_of[position] is fleet.buses[0]]
+    started, cpu = time.perf_counter(), time.process_time()
+    for index in range(count):
+        position = positions[index % len(positions)]
+        fleet.submit(position, fleet.packets[position][STATUS_COMMAND], lambda reply: done.release())
+    for _ in range(count):
+        done.acquire()
+    return {"seconds": time.perf_counter() - started, "cpu_per_transaction": (time.process_time() - cpu) / count}
+
+
+def async_client(port, addresses, count, transport):
+    # The round trips and queued requests above through the asyncio client on one bus, see agc_async.py.
+    async def run():
+        async with AGCClient(port, addresses, transport=transport) as client:
+            times = []
+            for index in range(count):
+                started = time.perf_counter()
+                await client.status(index % len(addresses))
+                times.append(time.perf_counter() - started)
+            started, cpu = time.perf_counter(), time.process_time()
+            await asyncio.gather(*[client.status(index % len(addresses)) for index in range(count)])
+            return {"status": summarise(times),
+                    "queued": {"seconds": time.perf_counter() - started,
+                               "cpu_per_transaction": (time.process_time() - cpu) / count}}
+    return asyncio.run(run())
+
+
+def decode_throughput(frame, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        decode_status(frame)
+    single = count / (time.perf_counter() - started)
+    frames = frame * (count * 100)
+    started = time.perf_counter()
+    decode_status_batch(frames)
+    batch = count * 100 / (time.perf_counter() - started)
+    return {"decode_status": {"frames_per_second": single}, "decode_status_batch": {"frames_per_second": batch}}
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def regressions(results, previous, tolerance):
+    old = dict(flatten(previous["results"]))
+    found = []
+    for key, value in flatten(results):
+        if key not in old or not old[key] or key.endswith(("count", "failures")):
+            continue
+        change = value / old[key] - 1
+        if key.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            found.append((key, old[key], value))
+    return found
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(__file__),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AGC bus round trip, sweep and decode benchmark")
+    parser.add_argument("--port", nargs="+", help="serial ports, the positions are split between them. "
+                                                  "Simulated buses are used when left out")
+    parser.add_argument("--buses", type=int, default=1, help="number of simulated buses")
+    parser.add_argument("--positions", default=POSITIONS_CSV, help="antenna_positions.csv")
+    parser.add_argument("--commands", nargs="+", default=list(READ_ONLY), choices=sorted(COMMANDS_BY_NAME))
+    parser.add_argument("--allow-control", action="store_true",
+                        help="let --commands send commands that change a transmitter (relay, loop, capacitors, "
+                             "reset) to a real bus given by --port")
+    parser.add_argument("--count", type=int, default=200, help="round trips per command")
+    parser.add_argument("--sweeps", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=5.0, help="simulated reply latency in ms")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT, help="see agc_transport.py")
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--compare", help="results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slow down before a regression")
+    args = parser.parse_args()
+    if args.port and not args.allow_control and not set(args.commands) <= set(READ_ONLY):
+        parser.error(f"only {' and '.join(READ_ONLY)} are sent to a real bus without --allow-control")
+
+    if os.path.exists(args.positions):
+        addresses = load_addresses(args.positions)
+    else:
+        addresses = tuple(range(0x10, 0x20))
+    buses = len(args.port) if args.port else args.buses
+    # Positions split as evenly as they go, the first buses taking one more
+    groups = [addresses[bus * len(addresses) // buses:(bus + 1) * len(addresses) // buses] for bus in range(buses)]
+    simulators = []
+    ports = args.port
+    if ports is None:
+        simulators = [BusSimulator(group, DEFAULT_NODE._replace(latency=args.latency / 1000), seed=1)
+                      for group in groups]
+        ports = [simulator.start() for simulator in simulators]
+    fleet = Fleet([BusGroup(port, group, os.path.basename(port)) for port, group in zip(ports, groups)], profiles=None,
+                  transport=args.transport)
+    fleet.start()
+    try:
+        cpu = [thread_cpu(bus) for bus in fleet.buses]
+        results = {name: round_trips(fleet, name, args.count) for name in args.commands}
+        results["sweep"] = sweeps(fleet, args.sweeps)
+        # CPU of the bus threads alone over the round trips and sweeps, the simulated buses are not counted
+        if None not in cpu:
+            transactions = sum(timings["write"]["count"]
+                               for bus in fleet.buses for timings in bus.metrics.summary().values())
+            used = sum(thread_cpu(bus) - before for bus, before in zip(fleet.buses, cpu))
+            results["bus_thread"] = {"cpu_per_transaction": used / transactions}
+        results["ping_during_sweep"] = during_sweeps(fleet, min(args.count, 2 * len(fleet.packets)))
+        results["queued"] = queued(fleet, args.count)
+        reply = fleet.call(0, fleet.packets[0][STATUS_COMMAND])
+    finally:
+        fleet.stop()
+        fleet.join()
+    try:
+        # The asyncio client has the first port to itself once the bus workers are done with it. It only talks to
+        # serial ports, not to a broker.
+        if not is_broker(ports[0]):
+            results["async"] = async_client(ports[0], groups[0], args.count, args.transport)
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+    if reply_ok(reply.packet, reply.data):
+        results.update(decode_throughput(reply.data, 10000))
+
+    for name in args.commands:
+        if "p50" in results[name]:
+            print(f"{name:8s} p50 {results[name]['p50'] * 1000:7.2f} ms  p95 {results[name]['p95'] * 1000:7.2f} ms  "
+                  f"p99 {results[name]['p99'] * 1000:7.2f} ms  failures {results[name]['failures']}")
+        else:
+            print(f"{name:8s} no replies")
+    sweep = results["sweep"]
+    print(f"sweep    p50 {sweep['p50'] * 1000:7.1f} ms for {len(fleet.packets)} positions on {buses} buses, "
+          f"{sweep['bytes_per_second']:.0f} B/s, {sweep['bus_efficiency'] * 100:.0f}% of {BAUDRATE} baud per bus")
+    if "bus_thread" in results:
+        print(f"bus threads {results['bus_thread']['cpu_per_transaction'] * 1e6:.0f} us CPU per transaction "
+              f"through {args.transport}")
+    during = results["ping_during_sweep"]
+    print(f"ping during sweeps p50 {during['p50'] * 1000:7.2f} ms  p99 {during['p99'] * 1000:7.2f} ms")
+    for name, measured in (("bus worker", results["queued"]), ("asyncio", results.get("async", {}).get("queued"))):
+        if measured is not None:
+            print(f"{name:10s} {args.count} queued at once {measured['seconds']:6.2f} s, "
+                  f"{measured['cpu_per_transaction'] * 1e6:5.0f} us CPU per transaction")
+    if "async" in results:
+        status = results["async"]["status"]
+        print(f"asyncio status p50 {status['p50'] * 1000:7.2f} ms  p99 {status['p99'] * 1000:7.2f} ms")
+    for name in ("decode_status", "decode_status_batch"):
+        if name in results:
+            print(f"{name:20s} {results[name]['frames_per_second']:12.0f} frames/s")
+
+    document = {"version": version(), "port": args.port or "simulated", "buses": buses, "transport": args.transport,
+                "python": sys.version.split()[0], "results": results}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(document, output, indent=2)
+    if args.compare:
+        with open(args.compare) as previous_file:
+            found = regressions(results, json.load(previous_file), args.tolerance)
+        for key, old, new in found:
+            print(f"REGRESSION {key}: {old:.6g} -> {new:.6g}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# Start up benchmark for the AGC commander
+# Times each way of starting the commander in a fresh python process, from launch to ready, and reports the
+# peak resident memory of that process. Run from anywhere:
+#   python benchmarks/startup.py [--runs 5] [--output startup.json] [scenario ...]
+# The window scenarios need a display, or QT_QPA_PLATFORM=offscreen.
+# Without a real antenna_positions.csv a 16 position one is made up, the serial port is a pseudo terminal.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each scenario is the code run in the fresh process, it has to get the commander to the point of being usable.
+SCENARIOS = {
+    "headless": "import os\n"
+                "import agc_cli\n"
+                "master, slave = os.openpty()\n"
+                "fleet = agc_cli.Fleet.single(os.ttyname(slave), agc_cli.load_addresses(), profiles=None)\n"
+                "fleet.start()\n"
+                "fleet.stop()\n"
+                "fleet.join()\n",
+    "gui_import": "import agc_commander\n",
+    "gui_window": "import os\n"
+                  "from PyQt5.QtWidgets import QApplication\n"
+                  "import agc_commander\n"
+                  "master, slave = os.openpty()\n"
+                  "app = QApplication([])\n"
+                  "window = agc_commander.AGCUI(os.ttyname(slave))\n"
+                  "app.processEvents()\n"
+                  "window.close()\n",
+}
+
+REPORT = ("import json, resource\n"
+          "print(json.dumps({'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))\n")
+
+
+def make_positions_csv():
+    positions = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False)
+    positions.write("position,agc\n")
+    for position in range(16):
+        positions.write(f"{position + 1},{0x10 + position:x}\n")
+    positions.close()
+    return positions.name
+
+
+def run_scenario(code, env):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code + REPORT], cwd=REPO, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1])["rss_kb"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AGC commander start up time and memory")
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(sorted(SCENARIOS))}, all by default")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--positions", help="antenna_positions.csv to use")
+    parser.add_argument("--output", help="also write the results here as JSON")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    env = dict(os.environ)
+    made_up_positions = None
+    if not (args.positions or env.get("AGC_POSITIONS_CSV")):
+        made_up_positions = make_positions_csv()
+    env["AGC_POSITIONS_CSV"] = args.positions or env.get("AGC_POSITIONS_CSV") or made_up_positions
+    results = {}
+    for name in args.scenarios or sorted(SCENARIOS):
+        runs = [run_scenario(SCENARIOS[name], env) for _ in range(args.runs)]
+        results[name] = {"seconds_median": statistics.median(run[0] for run in runs),
+                         "seconds_min": min(run[0] for run in runs),
+                         "rss_kb": max(run[1] for run in runs)}
+        print(f"{name:12s} {results[name]['seconds_median'] * 1000:8.1f} ms  "
+              f"{results[name]['rss_kb'] / 1024:6.1f} MB")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"python": sys.version.split()[0], "runs": args.runs, "results": results}, output, indent=2)
+    if made_up_positions:
+        os.unlink(made_up_positions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Requests through the broker, and its Unix socket
+import socket
+
+import pytest
+
+from agc_broker import REQUEST, RESPONSE, Broker, BrokerClient, connect
+from agc_bus import BusWorker
+from agc_protocol import STATUS_COMMAND, encode, reply_ok
+from agc_simulator import BusSimulator
+from agc_timeouts import TimeoutProfile
+
+ADDRESS = 0x10
+
+
+@pytest.fixture
+def broker(tmp_path):
+    simulator = BusSimulator([ADDRESS], seed=1)
+    bus = BusWorker(simulator.start(), profile=TimeoutProfile(None, 0.02, 1.0))
+    bus.start()
+    broker = Broker(bus)
+    broker.start()
+    address = f"unix://{tmp_path / 'agc_bus.sock'}"
+    broker.listen(address)
+    yield broker, address
+    broker.stop()
+    bus.stop()
+    bus.join()
+    simulator.stop()
+
+
+def test_status_through_broker(broker):
+    broker, address = broker
+    client = BrokerClient(address)
+    client.start()
+    packet = encode(ADDRESS, STATUS_COMMAND)
+    assert reply_ok(packet, client.call(packet).data)
+    client.stop()
+
+
+def test_unknown_priority_is_answered(broker):
+    broker, address = broker
+    sock = connect(address)
+    replies = sock.makefile("rb")
+    packet = encode(ADDRESS, STATUS_COMMAND)
+    sock.sendall(REQUEST.pack(7, 1, 200, len(packet)) + packet)
+    number, *timing, length = RESPONSE.unpack(replies.read(RESPONSE.size))
+    assert (number, length) == (7, 0)
+    # The client is still served
+    sock.sendall(REQUEST.pack(8, 1, 1, len(packet)) + packet)
+    number, *timing, length = RESPONSE.unpack(replies.read(RESPONSE.size))
+    assert number == 8
+    assert reply_ok(packet, replies.read(length))
+    sock.close()
+
+
+def test_path_of_running_broker_is_not_taken(broker):
+    broker, address = broker
+    with pytest.raises(OSError):
+        Broker(None).listen(address)
+    # Still answering
+    connect(address).close()
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = tmp_path / "agc_bus.sock"
+    # A socket file nobody is listening on, as a broker that was killed leaves behind
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(path))
+    stale.close()
+    broker = Broker(None)
+    broker.listen(f"unix://{path}")
+    connect(f"unix://{path}").close()
+    broker.stop()
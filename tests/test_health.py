@@ -0,0 +1,91 @@
+# Circuit breaker states and backoff in HealthTracker, and sweeps leaving out open breakers
+import pytest
+
+from agc_cli import sweep
+from agc_fleet import Fleet
+from agc_health import HALF_OPEN, HEALTHY, OPEN, SUSPECT, HealthTracker
+from agc_simulator import DEFAULT_NODE, BusSimulator
+
+ADDRESS = 0x10
+
+
+def test_opens_after_missed_replies():
+    health = HealthTracker(failures_to_open=3, base_backoff=10.0)
+    health.record(ADDRESS, False, now=0.0)
+    assert health.node(ADDRESS).state == SUSPECT
+    health.record(ADDRESS, False, now=1.0)
+    assert health.node(ADDRESS).state == SUSPECT
+    assert health.allow(ADDRESS, now=1.0)
+    health.record(ADDRESS, False, now=2.0)
+    node = health.node(ADDRESS)
+    assert (node.state, node.failures, node.backoff, node.retry_at) == (OPEN, 3, 10.0, 12.0)
+    # Not a probe until the backoff is up
+    assert not health.take_probe(ADDRESS, now=2.0)
+
+
+def test_probe_once_backoff_is_up():
+    health = HealthTracker(failures_to_open=1, base_backoff=10.0)
+    health.record(ADDRESS, False, now=0.0)
+    assert not health.allow(ADDRESS, now=9.9)
+    assert health.allow(ADDRESS, now=10.0)
+    assert health.node(ADDRESS).state == HALF_OPEN
+    # Only the one probe until another backoff has gone by
+    assert not health.allow(ADDRESS, now=11.0)
+    assert health.take_probe(ADDRESS, now=11.0)
+    assert not health.take_probe(ADDRESS, now=11.0)
+
+
+def test_probe_without_sweeps():
+    # On a bus nobody sweeps the first request once the probe is due is the probe
+    health = HealthTracker(failures_to_open=1, base_backoff=10.0)
+    health.record(ADDRESS, False, now=0.0)
+    assert not health.take_probe(ADDRESS, now=5.0)
+    assert health.take_probe(ADDRESS, now=10.0)
+    assert health.node(ADDRESS).state == HALF_OPEN
+    assert not health.take_probe(ADDRESS, now=10.5)
+
+
+def test_missed_probe_doubles_backoff_up_to_maximum():
+    health = HealthTracker(failures_to_open=1, base_backoff=10.0, max_backoff=30.0)
+    health.record(ADDRESS, False, now=0.0)
+    now = 0.0
+    for backoff in (20.0, 30.0, 30.0):
+        now = health.node(ADDRESS).retry_at
+        assert health.allow(ADDRESS, now=now)
+        health.record(ADDRESS, False, now=now)
+        node = health.node(ADDRESS)
+        assert (node.state, node.backoff, node.retry_at) == (OPEN, backoff, now + backoff)
+
+
+def test_answered_probe_closes():
+    health = HealthTracker(failures_to_open=1, base_backoff=10.0)
+    changes = []
+    health.add_listener(lambda node: changes.append(node.state))
+    health.record(ADDRESS, False, now=0.0)
+    assert health.allow(ADDRESS, now=10.0)
+    health.record(ADDRESS, True, now=10.0)
+    node = health.node(ADDRESS)
+    assert (node.state, node.failures, node.retry_at) == (HEALTHY, 0, None)
+    assert not health.take_probe(ADDRESS, now=10.0)
+    assert changes == [OPEN, HALF_OPEN, HEALTHY]
+
+
+@pytest.fixture
+def fleet():
+    simulator = BusSimulator([0x10, 0x11], DEFAULT_NODE._replace(jitter=0.0),
+                             nodes={0x11: DEFAULT_NODE._replace(drop=1.0)}, seed=1)
+    fleet = Fleet.single(simulator.start(), [0x10, 0x11], timeout=0.05, minimum=0.02, profiles=None,
+                         base_backoff=60.0)
+    fleet.start()
+    yield fleet
+    fleet.stop()
+    fleet.join()
+    simulator.stop()
+
+
+def test_sweep_leaves_out_dead_node(fleet):
+    for _ in range(3):
+        assert sweep(fleet) == 1
+    assert not fleet.allow(1)
+    assert fleet.allow(0)
+    assert sweep(fleet) == 1
@@ -0,0 +1,84 @@
+# Reply framing: FrameParser, read_reply and reply_ok
+from agc_protocol import ACK_LENGTH, STATUS_COMMAND, STATUS_LENGTH, STX, COMMANDS_BY_NAME, FrameParser, \
+    block_checksum, encode, read_reply, reply_ok
+from agc_simulator import DEFAULT_NODE, BusSimulator
+from agc_transport import open_port
+
+ADDRESS = 0x10
+
+
+def status_frame(address=ADDRESS, readings=bytes(range(20, 31))):
+    body = bytes([address, 1 + len(readings), STATUS_COMMAND]) + readings
+    return bytes([STX]) + body + bytes([block_checksum(body)])
+
+
+def test_status_frame_in_pieces():
+    frame = status_frame()
+    parser = FrameParser(ADDRESS)
+    for byte in frame[:-1]:
+        assert parser.feed(bytes([byte])) is None
+        assert parser.bytes_needed() > 0
+    assert parser.feed(frame[-1:]) == frame
+    assert len(frame) == STATUS_LENGTH
+
+
+def test_resyncs_past_noise_and_a_stray_stx():
+    frame = status_frame()
+    parser = FrameParser(ADDRESS)
+    assert parser.feed(b"\x00\xff" + bytes([STX]) + b"\x13") is None
+    assert parser.feed(frame) == frame
+
+
+def test_skips_another_address():
+    frame = status_frame()
+    parser = FrameParser(ADDRESS)
+    assert parser.feed(status_frame(0x11) + frame) == frame
+
+
+def test_rejects_a_bad_bcc():
+    frame = status_frame()
+    bad = frame[:-1] + bytes([frame[-1] ^ 0x01])
+    parser = FrameParser(ADDRESS)
+    assert parser.feed(bad) is None
+    # The good frame after it is still found
+    assert parser.feed(frame) == frame
+
+
+def test_ack():
+    packet = encode(ADDRESS, COMMANDS_BY_NAME["ping"].opcode)
+    parser = FrameParser(ADDRESS, ack=True)
+    assert parser.feed(b"\x00" + bytes([STX])) is None
+    ack = parser.feed(bytes([ADDRESS]))
+    assert ack == bytes([STX, ADDRESS])
+    assert len(ack) == ACK_LENGTH
+    assert reply_ok(packet, ack)
+
+
+def test_reply_ok():
+    packet = encode(ADDRESS, STATUS_COMMAND)
+    frame = status_frame()
+    assert reply_ok(packet, frame)
+    assert not reply_ok(packet, frame[:-1] + bytes([frame[-1] ^ 0x01]))
+    assert not reply_ok(packet, status_frame(0x11))
+    assert not reply_ok(packet, frame[:-2])
+    assert not reply_ok(encode(ADDRESS, COMMANDS_BY_NAME["ping"].opcode), bytes([STX, 0x11]))
+
+
+def test_read_reply_leaves_port_timeout():
+    simulator = BusSimulator([ADDRESS], DEFAULT_NODE, seed=1)
+    ser = open_port(simulator.start(), timeout=0.5)
+    try:
+        packet = encode(ADDRESS, STATUS_COMMAND)
+        ser.write(packet)
+        data, timing = read_reply(ser, packet, 0.2)
+        assert reply_ok(packet, data)
+        assert ser.timeout == 0.5
+        # Nothing is at 0x11, so the time runs out
+        packet = encode(0x11, STATUS_COMMAND)
+        ser.write(packet)
+        data, timing = read_reply(ser, packet, 0.05)
+        assert data == b"" and timing.first_byte is None
+        assert ser.timeout == 0.5
+    finally:
+        ser.close()
+        simulator.stop()
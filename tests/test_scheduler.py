@@ -0,0 +1,78 @@
+# Priority classes, starvation and turns between sources in TransactionQueue
+import threading
+
+from agc_scheduler import BACKGROUND, CONTROL, STATUS, TransactionQueue
+
+
+def drain(queue):
+    taken = []
+    while True:
+        item = queue.poll()
+        if item is None:
+            return taken
+        taken.append(item)
+
+
+def test_classes_run_in_order():
+    queue = TransactionQueue()
+    queue.put("sweep", BACKGROUND)
+    queue.put("status", STATUS)
+    queue.put("trip", CONTROL)
+    queue.put("reset", CONTROL)
+    assert drain(queue) == [("trip", CONTROL), ("reset", CONTROL), ("status", STATUS), ("sweep", BACKGROUND)]
+
+
+def test_starved_background_goes_between_status():
+    queue = TransactionQueue(starvation_limit=0.0)
+    for number in range(3):
+        queue.put(f"sweep {number}", BACKGROUND)
+        queue.put(f"status {number}", STATUS)
+    assert [item for item, priority in drain(queue)] == \
+        ["sweep 0", "status 0", "sweep 1", "status 1", "sweep 2", "status 2"]
+    assert queue.summary()["promoted"] == 3
+
+
+def test_waiting_background_is_not_promoted():
+    queue = TransactionQueue(starvation_limit=60.0)
+    queue.put("sweep", BACKGROUND)
+    queue.put("status", STATUS)
+    assert [item for item, priority in drain(queue)] == ["status", "sweep"]
+    assert queue.summary()["promoted"] == 0
+
+
+def test_control_goes_ahead_of_starved_background():
+    queue = TransactionQueue(starvation_limit=0.0)
+    queue.put("sweep", BACKGROUND)
+    queue.put("status", STATUS)
+    queue.put("trip", CONTROL)
+    assert queue.poll() == ("trip", CONTROL)
+
+
+def test_sources_take_turns():
+    queue = TransactionQueue()
+    for number in range(3):
+        queue.put(f"a{number}", STATUS, "a")
+    queue.put("b0", STATUS, "b")
+    queue.put("b1", STATUS, "b")
+    assert [item for item, priority in drain(queue)] == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_discard():
+    queue = TransactionQueue()
+    queue.put("a", STATUS, "a")
+    queue.put("b", STATUS, "b")
+    queue.discard("a")
+    assert drain(queue) == [("b", STATUS)]
+    assert queue.summary()["status"]["depth"] == 0
+
+
+def test_close_wakes_get():
+    queue = TransactionQueue()
+    queue.put("status", STATUS)
+    taken = []
+    getter = threading.Thread(target=lambda: taken.extend([queue.get(), queue.get()]))
+    getter.start()
+    queue.close()
+    getter.join(5)
+    assert not getter.is_alive()
+    assert taken == [("status", STATUS), None]
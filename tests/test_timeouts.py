@@ -0,0 +1,107 @@
+# Learned reply timeouts together with the circuit breakers, on the simulated bus
+import time
+
+import pytest
+
+from agc_bus import BusWorker
+from agc_fleet import Fleet
+from agc_health import HEALTHY, OPEN, HealthTracker
+from agc_protocol import COMMANDS_BY_NAME, STATUS_COMMAND, encode, reply_ok
+from agc_simulator import DEFAULT_NODE, BusSimulator
+from agc_timeouts import TimeoutProfile
+
+ADDRESS = 0x10
+
+
+@pytest.fixture
+def bus():
+    simulator = BusSimulator([ADDRESS], DEFAULT_NODE._replace(jitter=0.0), seed=1)
+    worker = BusWorker(simulator.start(), profile=TimeoutProfile(None, 0.02, 1.0),
+                       health=HealthTracker(base_backoff=0.2))
+    worker.start()
+    yield simulator, worker
+    worker.stop()
+    worker.join()
+    simulator.stop()
+
+
+def status(worker):
+    packet = encode(ADDRESS, STATUS_COMMAND)
+    reply = worker.call(packet)
+    return reply_ok(packet, reply.data)
+
+
+def test_learned_wait_is_short():
+    profile = TimeoutProfile(None, 0.02, 1.0)
+    for _ in range(20):
+        profile.record(STATUS_COMMAND, ADDRESS, 0.011)
+    assert profile.timeout(STATUS_COMMAND, ADDRESS) < 0.05
+    # A node that was never heard from is not waited for as long as the maximum
+    profile.record(STATUS_COMMAND, 0x11, None)
+    assert profile.timeout(STATUS_COMMAND, 0x11) < 0.05
+
+
+def test_first_miss_after_answering_waits_the_maximum():
+    profile = TimeoutProfile(None, 0.02, 1.0)
+    for _ in range(20):
+        profile.record(STATUS_COMMAND, ADDRESS, 0.011)
+    profile.record(STATUS_COMMAND, ADDRESS, None)
+    assert profile.timeout(STATUS_COMMAND, ADDRESS) == 1.0
+    profile.record(STATUS_COMMAND, ADDRESS, None)
+    assert profile.timeout(STATUS_COMMAND, ADDRESS) < 0.2
+    assert profile.timeout(STATUS_COMMAND, ADDRESS, probe=True) == 1.0
+
+
+def test_slow_node_is_not_marked_dead(bus):
+    simulator, worker = bus
+    for _ in range(20):
+        assert status(worker)
+    assert worker.profile.timeout(STATUS_COMMAND, ADDRESS) < 0.05
+    # Slower than anything learned, but well inside the maximum
+    node = simulator.nodes[ADDRESS]
+    node.config = node.config._replace(latency=0.3)
+    answered = [status(worker) for _ in range(6)]
+    # Only the first is missed, the wait after it is long enough to hear and learn the new latency
+    assert answered == [False] + [True] * 5
+    assert worker.health.node(ADDRESS).state == HEALTHY
+    assert worker.profile.timeout(STATUS_COMMAND, ADDRESS) > 0.3
+
+
+def test_probe_of_open_breaker_waits_the_maximum(bus):
+    simulator, worker = bus
+    for _ in range(20):
+        assert status(worker)
+    node = simulator.nodes[ADDRESS]
+    node.config = node.config._replace(drop=1.0)
+    while worker.health.node(ADDRESS).state != OPEN:
+        status(worker)
+    # It comes back, slower than before
+    node.config = node.config._replace(drop=0.0, latency=0.3)
+    time.sleep(0.25)
+    assert worker.health.allow(ADDRESS)
+    assert status(worker)
+    assert worker.health.node(ADDRESS).state == HEALTHY
+
+
+def test_open_breaker_keeps_costing_the_short_wait():
+    simulator = BusSimulator([0x10, 0x11, 0x12], DEFAULT_NODE._replace(jitter=0.0), seed=1)
+    fleet = Fleet.single(simulator.start(), [0x10, 0x11, 0x12], minimum=0.02, profiles=None, base_backoff=60.0)
+    fleet.start()
+    try:
+        trip = COMMANDS_BY_NAME["relay_trip"].opcode
+        for _ in range(6):
+            assert all(result.ok for result in fleet.call_batch(trip))
+        node = simulator.nodes[0x12]
+        node.config = node.config._replace(drop=1.0)
+        while fleet.bus_of[2].health.node(0x12).state != OPEN:
+            fleet.call_batch(trip, [2], retries=0)
+        # However many times it has missed, each batch costs the dead node three short waits, not three seconds
+        for _ in range(10):
+            started = time.monotonic()
+            results = fleet.call_batch(trip)
+            assert time.monotonic() - started < 0.5
+            assert [result.ok for result in results] == [True, True, False]
+    finally:
+        fleet.stop()
+        fleet.join()
+        simulator.stop()